@@ -0,0 +1,503 @@
+###############################################################################
+##  Laboratorio de Engenharia de Computadores (LECOM),                       ##
+##  Universidade Federal de Minas Gerais (UFMG).                             ##
+##                                                                           ##
+##  Benchmarks for the simulator. Usage:                                     ##
+##      python benchmark.py <name> [...]                                     ##
+##      python benchmark.py suite --output new.json --baseline old.json     ##
+##                                                                           ##
+##  Author: Eduardo Pinto                                                    ##
+###############################################################################
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from messages import MessageGenerator as MG
+from modens import AcousticModem as AM
+from modens import OpticalModem as OM
+from concurrent.futures import ProcessPoolExecutor
+from node import Node, UOARState, UOARStatus
+from outbox import DropPolicy, Outbox
+from simulator import Simulator
+from tools import Clock, Tools, INFINITY
+from tracer import TraceEvent, Tracer
+
+# Average number of acoustic neighbors per node (keeps density constant when
+# the number of nodes grows).
+DENSITY = 20
+
+def random_positions(numNodes, seed = 0):
+    # Uniform positions in a box with side chosen for constant node density.
+    rng = random.Random(seed)
+    volume = numNodes * (4 / 3 * 3.14159 * AM.maxrange ** 3) / DENSITY
+    side = volume ** (1 / 3)
+    return [[rng.random() * side, rng.random() * side, rng.random() * side]
+            for _ in range(numNodes)]
+
+def brute_force_neighbors(positions):
+    # Reference implementation: compares every pair of nodes.
+    aneighbors = {}
+    oneighbors = {}
+    for addr1, pos1 in enumerate(positions, 1):
+        alist = []
+        olist = []
+        for addr2, pos2 in enumerate(positions, 1):
+            if addr1 != addr2:
+                distance = Tools.distance(pos1, pos2)
+                if distance <= AM.maxrange:
+                    alist.append(addr2)
+                if distance <= OM.maxrange:
+                    olist.append(addr2)
+        aneighbors[addr1] = alist
+        oneighbors[addr1] = olist
+    return aneighbors, oneighbors
+
+def bench_neighbors(sizes = (1000, 2000, 5000, 10000, 20000, 50000, 100000),
+                    bruteLimit = 2000):
+    # Time of Simulator.update_nodes_info for a growing number of nodes.
+    print('%8s %12s %12s %8s' % ('nodes', 'index (s)', 'brute (s)', 'equal'))
+    for numNodes in sizes:
+        positions = random_positions(numNodes)
+        sim = Simulator()
+        for addr, pos in enumerate(positions, 1):
+            sim.create_node(addr, pos[0], pos[1], pos[2], 1)
+        begin = time.perf_counter()
+        sim.update_nodes_info()
+        indexTime = time.perf_counter() - begin
+        bruteTime = '-'
+        equal = '-'
+        if numNodes <= bruteLimit:
+            begin = time.perf_counter()
+            aneighbors, oneighbors = brute_force_neighbors(positions)
+            bruteTime = '%.3f' % (time.perf_counter() - begin)
+            equal = str(aneighbors == sim.aneighbors and \
+                        oneighbors == sim.oneighbors)
+        print('%8d %12.3f %12s %8s' % (numNodes, indexTime, bruteTime, equal))
+
+def build_simulator(numClusters = 4, nodesPerCluster = 8, appInterval = 60,
+                    seed = 0):
+    # Clustered scenario (as in Tools.distribute_nodes) with one sink.
+    random.seed(seed)
+    sim = Simulator()
+    sim.packetSize  = 100
+    sim.appStart    = 1000
+    sim.appInterval = appInterval
+    sim.appStop     = INFINITY
+    positions = Tools.distribute_nodes(2000, 2000, 500, numClusters,
+                                       nodesPerCluster, 1)
+    for addr, pos in enumerate(positions, 1):
+        sim.create_node(addr, pos[0], pos[1], pos[2], 1000)
+    return sim
+
+def run_quiet(sim, stopExec):
+    # Runs the simulation without its prints. Returns the wall time.
+    begin = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim.start(stopExec)
+    return time.perf_counter() - begin
+
+def bench_events(stopExec = 100000, appIntervals = (60, 600, 3000),
+                 timeIntervals = (None, 0.1)):
+    # Fixed TDMA loop versus the event driven loop (same seed). The time 
+    # intervals are as in bench_fastforward.
+    print('%10s %10s %12s %12s %8s' % ('slot (s)', 'interval', 'tdma (s)', 
+                                       'events (s)', 'equal'))
+    for timeInterval in timeIntervals:
+        for appInterval in appIntervals:
+            results = []
+            for eventDriven in (False, True):
+                sim = build_simulator(appInterval = appInterval)
+                sim.timeInterval = timeInterval
+                sim.eventDriven = eventDriven
+                sim.fastForward = False
+                wall = run_quiet(sim, stopExec)
+                results.append([wall, sim.collect_data(), sim.firstNode,
+                                [node.round for node in 
+                                 sim.nodesRef.values()]])
+            equal = results[0][1:] == results[1][1:]
+            print('%10s %10d %12.3f %12.3f %8s' % (timeInterval or 'auto', 
+                  appInterval, results[0][0], results[1][0], equal))
+
+def bench_fastforward(stopExec = 100000, appIntervals = (60, 600, 3000),
+                      seeds = (0, 1), timeIntervals = (None, 0.1)):
+    # TDMA loop without and with the jumps over quiescent periods. A time 
+    # interval of 0.1 s puts the alarms exactly on slot boundaries (None is 
+    # the interval calculated from the packet size).
+    print('%6s %10s %10s %12s %12s %8s' % ('seed', 'slot (s)', 'interval',
+                                           'plain (s)', 'jumps (s)', 'equal'))
+    for seed in seeds:
+        for timeInterval in timeIntervals:
+            for appInterval in appIntervals:
+                results = []
+                for fastForward in (False, True):
+                    sim = build_simulator(appInterval = appInterval, 
+                                          seed = seed)
+                    sim.timeInterval = timeInterval
+                    sim.fastForward = fastForward
+                    wall = run_quiet(sim, stopExec)
+                    results.append([wall, sim.collect_data(), sim.firstNode,
+                                    [node.round for node in 
+                                     sim.nodesRef.values()]])
+                equal = results[0][1:] == results[1][1:]
+                print('%6d %10s %10d %12.3f %12.3f %8s' % (seed, 
+                      timeInterval or 'auto', appInterval, results[0][0], 
+                      results[1][0], equal))
+
+def bench_messages(numMsgs = 100000, payloadSize = 80):
+    # Memory used by an outbox with numMsgs data messages (each one is an 
+    # acoustic message around an optical one, as the application creates).
+    payload = list(range(payloadSize)) # shared, as Node.basicPayload
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    begin = time.perf_counter()
+    outbox = []
+    for i in range(numMsgs):
+        msg = MG.create_optical_datamsg(2, 1, payload, 0.0)
+        outbox.append([MG.create_acoustic_datamsg(2, 3, msg, 0.0), 0])
+    elapsed = time.perf_counter() - begin
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print('messages: %d' % numMsgs)
+    print('creation time (s): %.3f' % elapsed)
+    print('total (MB): %.2f' % (used / 2 ** 20))
+    print('per queued message (bytes): %.1f' % (used / numMsgs))
+
+def bench_drops(numOps = 20000, maxMsgs = 4, seed = 0):
+    # Checks (asserts) the drop policies of a small outbox under random 
+    # pushes, transmissions, ACKs and head replacements: pairs already 
+    # transmitted are never dropped, DROP_HEAD never drops the new pair and
+    # the byte count matches the queued messages after every operation.
+    rng = random.Random(seed)
+    control = MG.create_iamsg(2, [0, 0, 0], 0, 0)
+    payloads = [list(range(size)) for size in (0, 10, 40, 80)]
+    print('%18s %8s %8s %8s' % ('policy', 'pushed', 'dropped', 'max len'))
+    for name, policy in sorted(vars(DropPolicy).items()):
+        if name.startswith('_'):
+            continue
+        outbox = Outbox(maxMsgs, None, policy)
+        numPushed = 0
+        maxLen = 0
+        for _ in range(numOps):
+            op = rng.random()
+            head = outbox.head()
+            if op < 0.5:
+                if rng.random() < 0.3:
+                    pair = [control, 0]
+                else:
+                    pair = [MG.create_optical_datamsg(2, 1, 
+                            rng.choice(payloads), 0.0), 0]
+                inFlight = [p for p in outbox if p[1] != 0]
+                dropped = outbox.push(pair)
+                numPushed += 1
+                queued = [id(p) for p in outbox]
+                assert all(p[1] == 0 for p in dropped), 'Pair in flight dropped'
+                assert all(id(p) in queued for p in inFlight), \
+                       'Pair in flight lost'
+                if policy is DropPolicy.DROP_HEAD:
+                    assert id(pair) in queued, 'New pair dropped'
+                # Above the capacity only if nothing else can be dropped
+                if policy is DropPolicy.DROP_HEAD:
+                    others = [p for p in outbox if p is not pair]
+                else:
+                    others = outbox.data # control messages are kept
+                assert not outbox.is_full() or \
+                       all(p[1] != 0 for p in others), 'Outbox is full'
+            elif op < 0.7 and head is not None:
+                head[1] += 1 # transmitted, waiting for the ACK
+            elif op < 0.9 and head is not None and head[1] != 0:
+                outbox.pop_head() # ACK received
+            elif head is not None and head[1] == 0 and \
+                 Outbox.is_control(head[0]):
+                outbox.replace_head([control, 0])
+            assert outbox.numBytes == sum(len(p[0]) for p in outbox), \
+                   'Wrong byte count'
+            maxLen = max(maxLen, len(outbox))
+        print('%18s %8d %8d %8d' % (name, numPushed, outbox.numDropped, 
+                                    maxLen))
+
+def bench_outbox(backlogs = (100, 1000, 10000, 100000), numOps = 20000):
+    # Congested relay: the outbox has a backlog of data messages and, for 
+    # each operation, a control message jumps the queue, is sent, and one
+    # data message is sent and replaced by a new one.
+    data = MG.create_optical_datamsg(2, 1, [], 0.0)
+    control = MG.create_iamsg(2, [0, 0, 0], 0, 0)
+    print('%8s %12s %12s' % ('backlog', 'list (s)', 'Outbox (s)'))
+    for backlog in backlogs:
+        outbox = [[data, 0] for _ in range(backlog)]
+        begin = time.perf_counter()
+        for _ in range(numOps):
+            outbox.insert(0, [control, 0])
+            outbox.pop(0)
+            outbox.pop(0)
+            outbox.append([data, 0])
+        listTime = time.perf_counter() - begin
+        outbox = Outbox()
+        for _ in range(backlog):
+            outbox.push([data, 0])
+        begin = time.perf_counter()
+        for _ in range(numOps):
+            outbox.push([control, 0])
+            outbox.pop_head()
+            outbox.pop_head()
+            outbox.push([data, 0])
+        outboxTime = time.perf_counter() - begin
+        print('%8d %12.4f %12.4f' % (backlog, listTime, outboxTime))
+
+def bench_handlers(numMsgs = 20000):
+    # Cost of Node.handle_message for each message type, in a relay that is
+    # a cluster head ready for routing.
+    factories = [
+        ('COMMON_DATA', lambda: MG.create_acoustic_datamsg(3, 2, 
+                        MG.create_optical_datamsg(3, 1, [0] * 80, 0.0), 0.0)),
+        ('ACK', lambda: MG.create_acoustic_ack(3, 2)),
+        ('INFO_ANNOUN', lambda: MG.create_iamsg(3, [10, 10, 10], 
+                                                UOARState.CLUSTER_HEAD, 2)),
+        ('SCORE_ANNOUN', lambda: MG.create_samsg(3, 100)),
+        ('CLUSTER_ANNOUN', lambda: MG.create_camsg(3, True, [10, 10, 10])),
+        ('ROUTE_ANNOUN', lambda: MG.create_ramsg(3, True, 1, 1, [10, 10, 10])),
+        ('REQ_SCORE', lambda: MG.create_rqsmsg(3)),
+        ('REQ_RINFO', lambda: MG.create_rqrmsg(3, 4)),
+        ('REP_RINFO', lambda: MG.create_acoustic_rprmsg(3, 2, 1, 1)),
+    ]
+    print('%16s %14s' % ('type', 'us/message'))
+    for name, factory in factories:
+        node = Node(2, 0, 0, 0, 1.0e6, Clock())
+        node.state = UOARState.CLUSTER_HEAD
+        node.status = UOARStatus.READY
+        node.nextHop = 1
+        node.hopsToSink = 1
+        msgs = [factory() for _ in range(numMsgs)]
+        begin = time.perf_counter()
+        for msg in msgs:
+            node.handle_message(msg)
+        elapsed = time.perf_counter() - begin
+        print('%16s %14.2f' % (name, 1.0e6 * elapsed / numMsgs))
+
+def bench_distribute(sizes = (1000, 10000, 100000, 1000000)):
+    # Time to generate clustered scenarios (1000 nodes per cluster).
+    print('%8s %14s %14s' % ('nodes', 'array (s)', 'list (s)'))
+    for numNodes in sizes:
+        numClusters = max(1, numNodes // 1000)
+        begin = time.perf_counter()
+        Tools.distribute_nodes_array(1.0e5, 1.0e5, 5.0e3, numClusters, 1000, 1)
+        arrayTime = time.perf_counter() - begin
+        begin = time.perf_counter()
+        Tools.distribute_nodes(1.0e5, 1.0e5, 5.0e3, numClusters, 1000, 1)
+        listTime = time.perf_counter() - begin
+        print('%8d %14.3f %14.3f' % (numNodes, arrayTime, listTime))
+
+def bench_imports(modules = ('simulator', 'visualization'), repeat = 5):
+    # Time to start a new interpreter and import each module (best of 
+    # repeat), like a worker process of a parameter sweep.
+    print('%16s %10s' % ('module', 'time (s)'))
+    for module in ('sys',) + tuple(modules):
+        best = None
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            subprocess.check_call([sys.executable, '-W', 'ignore', '-c', 
+                                   'import ' + module])
+            elapsed = time.perf_counter() - begin
+            if best is None or elapsed < best:
+                best = elapsed
+        print('%16s %10.3f' % (module, best))
+
+def bench_trace(stopExec = 20000):
+    # Cost of tracing (written to a temporary file) versus verbose prints.
+    modes = [
+        ('off', None),
+        ('state+drop', TraceEvent.STATE | TraceEvent.DROP | TraceEvent.ENERGY),
+        ('all', TraceEvent.ALL),
+        ('verbose', None),
+    ]
+    print('%12s %10s %10s' % ('mode', 'time (s)', 'events'))
+    for name, mask in modes:
+        sim = build_simulator()
+        sim.verbose = name == 'verbose'
+        for node in sim.nodesRef.values():
+            node.verbose = sim.verbose
+        tracer = None
+        if mask is not None:
+            tracer = Tracer(tempfile.TemporaryFile('w+'), mask)
+            sim.set_tracer(tracer)
+        wall = run_quiet(sim, stopExec)
+        numEvents = '-' if tracer is None else str(tracer.numEvents)
+        if tracer is not None:
+            tracer.file.close()
+        print('%12s %10.3f %10s' % (name, wall, numEvents))
+
+# Scenarios of the suite: parameters of the simulator (besides the nodes)
+SCENARIOS = {
+    # only discovery and clustering (application never starts)
+    'discovery': {'stopExec': 1000, 'appStart': 1001, 'appInterval': 60,
+                  'energy': 1000},
+    # steady state constant bit rate traffic
+    'steady'   : {'stopExec': 5000, 'appStart': 1000, 'appInterval': 60,
+                  'energy': 1000},
+    # more traffic than the sink can get (full outboxes)
+    'congested': {'stopExec': 3000, 'appStart': 1000, 'appInterval': 2,
+                  'energy': 1000, 'outboxMaxMsgs': 50},
+    # small outboxes that drop the next message to be sent
+    'congested-head': {'stopExec': 3000, 'appStart': 1000, 'appInterval': 5,
+                       'energy': 1000, 'outboxMaxMsgs': 5, 
+                       'dropPolicy': DropPolicy.DROP_HEAD, 
+                       'seed': 0}, # drops pairs waiting for ACK if unguarded
+    # all nodes run out of energy
+    'death'    : {'stopExec': 5000, 'appStart': 1000, 'appInterval': 60,
+                  'energy': 30},
+}
+
+def build_scenario(name, numClusters, nodesPerCluster = 8, seed = None):
+    # seed None means the seed of the scenario (default 1)
+    params = SCENARIOS[name]
+    if seed is None:
+        seed = params.get('seed', 1)
+    sim = Simulator()
+    sim.seed        = seed
+    sim.packetSize  = 100
+    sim.appStart    = params['appStart']
+    sim.appInterval = params['appInterval']
+    sim.appStop     = INFINITY
+    sim.outboxMaxMsgs = params.get('outboxMaxMsgs')
+    sim.dropPolicy  = params.get('dropPolicy', DropPolicy.DROP_TAIL)
+    positions = Tools.distribute_nodes(2000, 2000, 500, numClusters,
+                                       nodesPerCluster, 1, sim.topology_rng())
+    for addr, pos in enumerate(positions, 1):
+        sim.create_node(addr, pos[0], pos[1], pos[2], params['energy'])
+    return sim
+
+def run_scenario(name, numClusters, nodesPerCluster = 8, seed = None, 
+                 repeat = 3):
+    # Runs the seeded scenario repeat times (in its own process, for the 
+    # peak RSS) and returns the results of the fastest run.
+    params = SCENARIOS[name]
+    wall = INFINITY
+    for _ in range(repeat):
+        sim = build_scenario(name, numClusters, nodesPerCluster, seed)
+        wall = min(wall, run_quiet(sim, params['stopExec']))
+    data = sim.collect_data()
+    numSlots = int(params['stopExec'] / sim.timeInterval)
+    numMsgs = data['atransmissions'] + data['otransmissions']
+    peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peakRSS *= 1024 # in KB
+    return {
+        'scenario'   : name,
+        'nodes'      : len(sim.nodesRef),
+        'seed'       : sim.seed,
+        'wall'       : wall,
+        'slotsPerSec': numSlots / wall,
+        'msgsPerSec' : numMsgs / wall,
+        'peakRSS'    : peakRSS / 2 ** 20, # in MB
+        # results (must not change when only the speed changes)
+        'messages'   : numMsgs,
+        'sinkRecvd'  : data['sinkRecvdMsgs'],
+        'aliveNodes' : data['aliveNodes'],
+    }
+
+def bench_suite(scenarios = None, clusters = (2, 4, 8, 16), output = None,
+                baseline = None, tolerance = 0.1):
+    # Runs each scenario for a growing number of nodes (scaling curve). 
+    # Results are saved in output (JSON) and compared with the results in
+    # baseline, if given. Returns the number of regressions (slower than
+    # the baseline by more than tolerance, or with different results).
+    scenarios = scenarios or sorted(SCENARIOS.keys())
+    results = []
+    print('%14s %6s %10s %12s %12s %10s' % ('scenario', 'nodes', 'time (s)',
+          'slots/s', 'msgs/s', 'RSS (MB)'))
+    # A new process for each run, so the peak RSS is only of that run
+    context = multiprocessing.get_context('spawn')
+    for name in scenarios:
+        assert name in SCENARIOS, 'Unknown scenario: ' + name
+        for numClusters in clusters:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result = executor.submit(run_scenario, name, 
+                                         numClusters).result()
+            results.append(result)
+            print('%14s %6d %10.3f %12.0f %12.0f %10.1f' % (name, 
+                  result['nodes'], result['wall'], result['slotsPerSec'],
+                  result['msgsPerSec'], result['peakRSS']))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, f, indent=1)
+    if baseline is None:
+        return 0
+    return compare_results(results, baseline, tolerance)
+
+def compare_results(results, baseline, tolerance = 0.1):
+    # Prints the speedup of each run relative to the baseline file. Returns
+    # the number of regressions.
+    with open(baseline) as f:
+        old = dict(((r['scenario'], r['nodes']), r) 
+                   for r in json.load(f)['results'])
+    regressions = 0
+    print('%14s %6s %10s %10s %8s' % ('scenario', 'nodes', 'speedup', 
+                                      'RSS ratio', 'status'))
+    for result in results:
+        base = old.get((result['scenario'], result['nodes']))
+        if base is None:
+            continue
+        speedup = result['slotsPerSec'] / base['slotsPerSec']
+        status = 'ok'
+        if any(result[key] != base[key] 
+               for key in ('messages', 'sinkRecvd', 'aliveNodes')):
+            status = 'CHANGED'
+        elif speedup < 1 - tolerance:
+            status = 'SLOWER'
+        if status != 'ok':
+            regressions += 1
+        print('%14s %6d %10.2f %10.2f %8s' % (result['scenario'], 
+              result['nodes'], speedup, result['peakRSS'] / base['peakRSS'],
+              status))
+    return regressions
+
+BENCHMARKS = {
+    'distribute': bench_distribute,
+    'drops': bench_drops,
+    'events': bench_events,
+    'fastforward': bench_fastforward,
+    'handlers': bench_handlers,
+    'imports': bench_imports,
+    'messages': bench_messages,
+    'outbox': bench_outbox,
+    'neighbors': bench_neighbors,
+    'suite': bench_suite,
+    'trace': bench_trace,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulator benchmarks')
+    parser.add_argument('names', nargs='*', help='benchmarks (default: all)')
+    # options of the suite
+    parser.add_argument('--scenario', action='append', default=None)
+    parser.add_argument('--clusters', type=int, nargs='+', 
+                        default=[2, 4, 8, 16], 
+                        help='number of clusters (8 nodes each) of each run')
+    parser.add_argument('--output', default=None, help='JSON results file')
+    parser.add_argument('--baseline', default=None, 
+                        help='JSON results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    regressions = 0
+    for name in args.names or sorted(BENCHMARKS.keys()):
+        assert name in BENCHMARKS, 'Unknown benchmark: ' + name
+        print('== ' + name)
+        if name == 'suite':
+            regressions = bench_suite(args.scenario, args.clusters, 
+                                      args.output, args.baseline, 
+                                      args.tolerance)
+        else:
+            BENCHMARKS[name]()
+    sys.exit(1 if regressions != 0 else 0)
@@ -10,6 +10,8 @@
 from random import random
 from math import log10, sqrt, erfc, cos, pi, e
 
+import numpy as np
+
 class Channel:
     def use(self):
         raise NotImplementedError
@@ -18,6 +20,7 @@ class AcousticChannel(Channel):
     # Code based on PER from ns2
     __kvalues = [1.0, 1.5, 2.0] 
     soundSpeed = 1500 # Sound speed in water, in m/s
+    maxCacheSize = 64 # Max number of frequencies with cached terms
     def __init__(self, k, s, w):
         assert (k in self.__kvalues), 'k = 1.0 or 1.5 or 2.0'
         assert (s >= 0 and s <= 1), '0 <= s <= 1'
@@ -25,12 +28,43 @@ class AcousticChannel(Channel):
         self.k = k
         self.s = s
         self.w = w
+        # Thorp's attenuation and noise only depend on the frequency (and on
+        # s and w), so they are calculated once for each frequency.
+        self.__termsCache = {} # (frequency, s, w) -> [thorp, noise]
     
     def use(self, frequency, power, distance, packetSize):
         #
-        per = self.__per(distance, frequency, power, packetSize)
+        per = self.per(frequency, power, distance, packetSize)
         return not (random() < per)
 
+    def per(self, frequency, power, distance, packetSize):
+        # Packet error rate (same parameters of use)
+        return self.__per(distance, frequency, power, packetSize)
+
+    def per_many(self, distances, sizes, frequency, power, noise_bw = 2.35):
+        # Packet error rates for many links at once (same model of __per).
+        # distances in meters and sizes in bytes (arrays or scalars)
+        #
+        thorp, noise = self.__terms(frequency)
+        distances = np.asarray(distances, dtype=float)
+        sizes = np.asarray(sizes, dtype=float)
+        pl = 10.0 * self.k * np.log10(distances) + distances * thorp
+        snr = 10 ** ((power - pl - noise_bw * noise) / 10)
+        ber = 0.5 * (1 - np.sqrt(snr / (1 + snr)))
+        return 1.0 - (1.0 - ber) ** (8 * sizes)
+
+    def __terms(self, frequency):
+        # Cached Thorp's attenuation and noise for the frequency.
+        key = (frequency, self.s, self.w)
+        terms = self.__termsCache.get(key)
+        if terms is None:
+            if len(self.__termsCache) >= self.maxCacheSize:
+                # Discarding the oldest entry
+                del self.__termsCache[next(iter(self.__termsCache))]
+            terms = [self.__thorp(frequency), self.__noise(frequency)]
+            self.__termsCache[key] = terms
+        return terms
+
     def __pathloss(self, distance, frequency):
         # Transmission loss that occurs in a underwater acoustic channel.
         # distance in meters
@@ -38,7 +72,7 @@ class AcousticChannel(Channel):
         # k, the spreading factor
         #
         return 10.0 * self.k * log10(distance) \
-               + distance * self.__thorp(frequency)
+               + distance * self.__terms(frequency)[0]
         
 
     def __thorp(self, frequency):
@@ -82,7 +116,7 @@ class AcousticChannel(Channel):
         # noise_bw, receiver bandwidth in dB re uPa
         #
         pl = self.__pathloss(distance, frequency)
-        nf = noise_bw * self.__noise(frequency)
+        nf = noise_bw * self.__terms(frequency)[1]
         snrdB = Pt - pl - nf
         snr = 10 ** (snrdB/10)
         # using BPSK bit error rate w/ Rayleigh fading
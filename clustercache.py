@@ -0,0 +1,117 @@
+###############################################################################
+##  Laboratorio de Engenharia de Computadores (LECOM),                       ##
+##  Universidade Federal de Minas Gerais (UFMG).                             ##
+##                                                                           ##
+##  Warm start: the network state after the clusters and routes converge    ##
+##  is kept in a cache, so runs that only change the application (interval, ##
+##  stop, ...) skip the discovery, announcing and electing phases. Usage:    ##
+##      cache = ClusterCache('cache_dir')                                    ##
+##      sim = cache.start(sim, stopExec) # instead of sim.start(stopExec)    ##
+##                                                                           ##
+##  Author: Eduardo Pinto                                                    ##
+###############################################################################
+
+import hashlib
+import os
+import random
+
+from node import Node
+from simulator import Simulator
+
+class ClusterCache:
+    # Each entry is a checkpoint of the simulator taken at the end of the
+    # first round where the network converged (before the application
+    # starts), so a warm run gives the same results of a cold one. Entries
+    # are keyed by a hash of everything that affects those phases: nodes
+    # (addr, position, energy), packet size, time interval, outbox limits,
+    # loop mode (spatial reuse, event driven, fast forward) and the seed (or
+    # the random module state, if there is no seed). An entry is only used
+    # if the application of the run starts after the convergence.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def key(sim):
+        # Hash of the topology, the seed and the other setup parameters.
+        nodes = sorted((node.addr, tuple(node.position), node.energy,
+                        node.maxEnergy) for node in sim.nodesRef.values())
+        seed = sim.seed
+        if seed is None:
+            seed = random.getstate()
+        params = (nodes, seed, sim.packetSize, sim.timeInterval,
+                  sim.outboxMaxMsgs, sim.outboxMaxBytes, sim.dropPolicy,
+                  sim.spatialReuse, sim.eventDriven, sim.fastForward,
+                  sorted(Node.sinkNodesAddr))
+        return hashlib.sha1(repr(params).encode()).hexdigest()
+
+    def file_name(self, key):
+        return os.path.join(self.directory, key + '.pkl.gz')
+
+    def start(self, sim, stopExec):
+        # Same as sim.start(stopExec) for a new simulator, but the converged
+        # state comes from the cache when possible. Returns the simulator
+        # that ran (a new object on cache hits).
+        assert sim.clock.read() == 0, 'Simulation already started'
+        fileName = self.file_name(ClusterCache.key(sim))
+        warm = None
+        if os.path.exists(fileName):
+            warm = self.restore(sim, fileName)
+        if warm is not None:
+            self.hits += 1
+            sim = warm
+        else:
+            # (the network does not converge before an application that
+            # starts earlier than the cached one, so nothing is saved then)
+            self.misses += 1
+            sim.prepare()
+            self.converge(sim, fileName)
+        numSlots = int(stopExec / sim.timeInterval)
+        assert numSlots >= sim.slotsRun, 'Execution time is too short'
+        sim.pendingSlots = numSlots - sim.slotsRun
+        print('Simulation started')
+        sim.run_pending()
+        print('Simulation finished')
+        if sim.tracer is not None:
+            sim.tracer.flush()
+        sim.print_data()
+        return sim
+
+    def converge(self, sim, fileName):
+        # Runs rounds until the network converges and saves it. Nothing is
+        # saved if the application starts first.
+        roundSlots = sim.round_slots()
+        while (sim.slotsRun + roundSlots) * sim.timeInterval < sim.appStart:
+            sim.pendingSlots = roundSlots
+            sim.run_pending()
+            if sim.converged():
+                # Parameters of this run must not go to the cache
+                checkpointFile = sim.checkpointFile
+                sim.checkpointFile = None
+                sim.save_checkpoint(fileName)
+                sim.checkpointFile = checkpointFile
+                return True
+        return False
+
+    def restore(self, sim, fileName):
+        # Loads the converged simulator and applies the parameters of sim
+        # that are not part of the key. Returns None if the application of
+        # sim starts before the convergence (as in converge).
+        randomState = random.getstate()
+        warm = Simulator.load_checkpoint(fileName)
+        if warm.slotsRun * warm.timeInterval >= sim.appStart:
+            random.setstate(randomState)
+            return None
+        for name in ('appStart', 'appInterval', 'appStop', 'virtualPayload',
+                     'checkpointFile', 'checkpointInterval', 'verbose'):
+            setattr(warm, name, getattr(sim, name))
+        for node in warm.nodesRef.values():
+            node.verbose = sim.verbose
+        warm.set_tracer(sim.tracer)
+        warm.profiler = sim.profiler
+        # New application alarm (the cached one never went off)
+        warm.clock.mainAlarm.cancel()
+        warm.clock.mainAlarm = None
+        warm.prepare()
+        return warm
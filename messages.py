@@ -7,6 +7,8 @@
 ##  Author: Eduardo Pinto                                                    ##
 ###############################################################################
 
+from struct import Struct
+
 BROADCAST_ADDR = 0
 BASIC_TTL = 100
 
@@ -30,30 +32,107 @@ class UOARFlags:
     ACOUSTIC = 0x10
     WITH_ACK = 0x20
 
+class VirtualPayload:
+    # Payload that only has a size (in bytes). Used when the content of the
+    # application messages does not matter.
+    __slots__ = ('size',)
+    def __init__(self, size):
+        assert size >= 0, 'Payload size must be >= 0'
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
 class Message:
     # Basic message
     headerSize = 10 # 4 bytes for each addr + 1 for type + payload length + 
                     # 1 for ttl (time is just for statistics)       
+    headerFormat = Struct('>IIBB') # src, dst, flags (type + flags), ttl
+    __slots__ = ('src', 'dst', 'opts', 'ctime', 'payload', 'length')
     def __init__(self, src, dst, flags, payload, ctime, ttl):
+        self.reset(src, dst, flags, payload, ctime, ttl)
+
+    def reset(self, src, dst, flags, payload, ctime, ttl):
+        # Sets all fields (also used to reuse the message object).
+        assert 0 <= ttl <= 0xff, 'ttl must fit in one byte'
         self.src   = src
         self.dst   = dst
-        self.flags = flags
+        self.opts  = flags | (ttl << 8) # flags in the first byte, ttl in the 
+                                        # second
         self.ctime = ctime # just for statistics
-        self.ttl   = ttl
         if hasattr(payload, '__len__'):
             self.payload = payload
         else:
             self.payload = [payload]
+        # Payloads are not changed, so the length (that includes the nested
+        # messages) is calculated only once.
+        self.length = self.headerSize + len(self.payload)
+
+    @property
+    def flags(self):
+        return self.opts & 0xff
+
+    @flags.setter
+    def flags(self, flags):
+        self.opts = (self.opts & ~0xff) | (flags & 0xff)
+
+    @property
+    def ttl(self):
+        return self.opts >> 8
+
+    @ttl.setter
+    def ttl(self, ttl):
+        self.opts = (self.opts & 0xff) | (ttl << 8)
+
+    @property
+    def type(self):
+        return self.opts & 0x0f
 
     def __len__(self):
-        return (self.headerSize + len(self.payload))
+        return self.length
 
     def __str__(self):
         return 'Message from: ' + str(self.src) \
                 + ' to ' + str(self.dst) + '.' \
                 + ' (len = ' + str(len(self)) + ')'
+
+    def to_bytes(self):
+        # Header as it would be sent (payload is not included).
+        return self.headerFormat.pack(self.src, self.dst, self.flags, 
+                                      self.ttl)
+
+    def from_bytes(data, payload = None, ctime = 0):
+        # Creates a message from a header built by to_bytes.
+        assert len(data) >= Message.headerSize, 'Incomplete header'
+        src, dst, flags, ttl = Message.headerFormat.unpack_from(data)
+        if payload is None:
+            payload = []
+        return Message(src, dst, flags, payload, ctime, ttl)
     
 class MessageGenerator:
+    carrierPool = [] # released data messages (carriers) that can be reused
+    maxPoolSize = 1024
+
+    # Message that carries data, reusing a released carrier if possible.
+    def create_carrier(src, dst, payload, ctime, acoustic, ttl = BASIC_TTL):
+        if acoustic:
+            opt = UOARFlags.ACOUSTIC + UOARFlags.WITH_ACK + \
+                  UOARTypes.COMMON_DATA
+        else:
+            opt = UOARFlags.WITH_ACK + UOARTypes.COMMON_DATA
+        pool = MessageGenerator.carrierPool
+        if len(pool) != 0:
+            msg = pool.pop()
+            msg.reset(src, dst, opt, payload, ctime, ttl)
+            return msg
+        return Message(src, dst, opt, payload, ctime, ttl)
+
+    # Gives back a carrier that will not be used (or sent) anymore.
+    def release_carrier(msg):
+        pool = MessageGenerator.carrierPool
+        if len(pool) < MessageGenerator.maxPoolSize:
+            pool.append(msg)
+
     # Message that carries data
     def create_acoustic_datamsg(src, dst, payload, ctime, ttl = BASIC_TTL):
         opt = UOARFlags.ACOUSTIC + UOARFlags.WITH_ACK + UOARTypes.COMMON_DATA
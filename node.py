@@ -13,7 +13,9 @@ from messages import MessageGenerator as MG, BASIC_TTL
 from messages import BROADCAST_ADDR, Message, UOARFlags, UOARTypes
 from modens import AcousticModem as AM
 from modens import OpticalModem as OM
+from outbox import Outbox
 from tools import Tools, INFINITY
+from tracer import TraceEvent
 
 class UOARState:
     INITIAL        = 0
@@ -32,6 +34,28 @@ class UOARStatus:
     UPDATING    = 7
     RECOVERING  = 8
 
+class HeadList(dict):
+    # Cluster heads known by the node: addr -> received the hops message. It
+    # keeps the number of heads still missing, so checking if all heads 
+    # were heard is O(1).
+    pending = 0 # class default, used while unpickling (items are set first)
+
+    def __init__(self):
+        dict.__init__(self)
+        self.pending = 0
+
+    def __setitem__(self, addr, got):
+        if not dict.get(self, addr, True):
+            self.pending -= 1
+        if not got:
+            self.pending += 1
+        dict.__setitem__(self, addr, got)
+
+    def __delitem__(self, addr):
+        if not dict.__getitem__(self, addr):
+            self.pending -= 1
+        dict.__delitem__(self, addr)
+
 class Node:
     maxTransmissions = 3
     sinkNodesAddr = [1]
@@ -40,7 +64,7 @@ class Node:
         assert clock.__class__.__name__ is 'Clock', 'Need a clock object'
         self.verbose = verbose
         self.inbox = []
-        self.outbox = [] # pair [msg, number of transmissions]
+        self.outbox = Outbox() # pairs [msg, number of transmissions]
         self.waitingACK = False
         self.isSink = addr in self.sinkNodesAddr
         self.clock = clock
@@ -49,6 +73,8 @@ class Node:
         #
         self.addr      = addr
         self.position  = [x, y, depth]
+        self.onMove    = None # called as onMove(node) after a move
+        self.tracer    = None # Tracer for the events of the node (optional)
         # Energy related
         self.energy    = energy
         self.maxEnergy = energy
@@ -68,8 +94,8 @@ class Node:
         self.updateStatus = 0 # 0: not updating
                               # 1: update in progress
                               # 2: update done
-        self.cheadList = {} # to route phase [addr, is in route]
-        self.cmemberList = []
+        self.cheadList = HeadList() # to route phase [addr, is in route]
+        self.cmemberList = set()
         # self.score  = 0
         self.greaterDistance = 0
         self.avgDistance = 0
@@ -81,6 +107,7 @@ class Node:
         # for recovery (next hop is dead)
         self.msgsLostCount = 0
         self.msgsLostLimit = 2
+        self.msgsDroppedCount = 0 # dropped because the outbox was full
         self.deadNode      = None
         # for statistics
         self.recvdMsgsCounter = 0
@@ -102,6 +129,19 @@ class Node:
         self.position[0] = newX
         self.position[1] = newY
         self.position[2] = newDepth
+        if self.onMove is not None:
+            self.onMove(self)
+
+    def trace(self, event, *values):
+        # Writes the event in the tracer (if any). Only used for rare events:
+        # frequent ones must check the tracer mask first.
+        if self.tracer is not None:
+            self.tracer.emit(event, self.clock.read(), self.addr, *values)
+
+    def trace_drop(self, reason, msg):
+        if self.tracer is not None:
+            dst = -1 if msg.dst is None else msg.dst
+            self.trace(TraceEvent.DROP, reason, dst, msg.flags & 0x0f)
 
     def application_generate_msg(self):
         # Generates an application message and puts it into the end of the 
@@ -110,13 +150,22 @@ class Node:
         # Simulating the application message as one optical data message.
         msg = MG.create_optical_datamsg(self.addr, 1, self.basicPayload,
                                         self.clock.read()) 
-        if self.state is UOARState.CLUSTER_MEMBER:
-            end_msg = MG.create_optical_datamsg(self.addr, self.nextHop, msg,
-                                                self.clock.read()) 
-        else:
-            end_msg = MG.create_acoustic_datamsg(self.addr, self.nextHop,
-                                                 msg, self.clock.read())
-        self.outbox.append([end_msg, 0])
+        end_msg = MG.create_carrier(self.addr, self.nextHop, msg,
+                                    self.clock.read(), 
+                                    self.state is not UOARState.CLUSTER_MEMBER)
+        self.enqueue([end_msg, 0])
+
+    def enqueue(self, pair):
+        # Puts the pair [msg, number of transmissions] in the outbox, which
+        # may drop messages if it is full.
+        for dpair in self.outbox.push(pair):
+            dmsg = dpair[0]
+            self.msgsDroppedCount += 1
+            self.trace_drop('outbox', dmsg)
+            if (dmsg.flags & 0x0f) is UOARTypes.COMMON_DATA:
+                MG.release_carrier(dmsg)
+            if self.verbose:
+                print('(!) OUTBOX FULL, DROPPING MESSAGE')
 
     def calculate_score(self):
         # Calculates node score based on amoung of neighbots and energy level.
@@ -149,6 +198,8 @@ class Node:
 
         if self.isSink is False and self.energy <= self.energyThreshold and \
            (not self.criticalEnergy):
+            self.trace(TraceEvent.ENERGY, self.energy, 
+                       self.energyThreshold / self.maxEnergy)
             self.energyThreshold = self.energyThresholds.pop()
             if len(self.energyThresholds) is 0:
                 self.criticalEnergy = True
@@ -287,7 +338,7 @@ class Node:
                 self.stopWaiting = False
                 if self.hopsToSink is not INFINITY:
                     # All head neighbors have received the message of hops
-                    if not False in self.cheadList.values():
+                    if self.cheadList.pending == 0:
                         self.stopWaiting = True
                     else:
                         for addr, got in self.cheadList.items():
@@ -392,6 +443,28 @@ class Node:
         
         return time, msg
 
+    def is_idle(self):
+        # True when executing the node in a new slot would not change anything
+        # besides the round counter (used to skip its slots). It only stops
+        # being idle after receiving a message or an application message.
+        if self.energy <= 0:
+            return True
+        if self.isSink is False and self.energy <= self.energyThreshold and \
+           (not self.criticalEnergy):
+            return False
+        if self.state is UOARState.INITIAL:
+            return False
+        if self.status is UOARStatus.READY:
+            return len(self.outbox) == 0 and \
+                   self.msgsLostCount != self.msgsLostLimit
+        if self.status is UOARStatus.WAITING:
+            return not self.stopWaiting
+        if self.status is UOARStatus.HEAD_WAIT:
+            # Without a route nor an alternative, it just keeps waiting
+            return not self.stopWaiting and self.hopsToSink is INFINITY and \
+                   self.memberAlternative is None
+        return False
+
     def send_next_msg(self, remainingTime):
         # Sends the first message in the outbox if the time and energy are 
         # sufficient. Returns the sent message and the required time to 
@@ -401,20 +474,22 @@ class Node:
         time = 0
         msg = None
         if len(self.outbox) is not 0:
-            while self.outbox[0][1] is self.maxTransmissions:
+            while self.outbox.head()[1] is self.maxTransmissions:
                 # Reached the maximum number of transmissions allowed. 
                 # Discard it and move on. Must check if the outbox got empty.
                 if self.verbose:
                     print('(!) DROPPING MESSAGE')
-                dmsg = (self.outbox.pop(0))[0]
+                dmsg = (self.outbox.pop_head())[0]
+                self.trace_drop('retries', dmsg)
                 if (dmsg.flags & 0x0f) is UOARTypes.COMMON_DATA:
                     self.msgsLostCount += 1
+                    MG.release_carrier(dmsg)
                 self.waitingACK = False
                 if self.msgsLostCount is self.msgsLostLimit or \
                    len(self.outbox) is 0:
                     return time, msg
             # Will only sends a message if there is enough time and energy
-            pair = self.outbox[0]
+            pair = self.outbox.head()
             nextMsg = pair[0]
             if (nextMsg.flags & 0x0f) is UOARTypes.COMMON_DATA:
                 # Just the get the must updated next hop. (is useful when a 
@@ -432,7 +507,7 @@ class Node:
                 if etime < remainingTime and eenergy < self.energy:
                     # Broadcasts do not need ACK so they only got send once.
                     msg = nextMsg
-                    self.outbox.pop(0)
+                    self.outbox.pop_head()
                     self.energy -= eenergy
                     time = etime
                 else:
@@ -447,7 +522,7 @@ class Node:
                     etimeAck = etime + self.opticalAckTime
                 if etimeAck < remainingTime and energy < self.energy:
                     msg = nextMsg
-                    self.outbox[0][1] += 1
+                    pair[1] += 1
                     self.waitingACK = True
                     self.energy -= eenergy
                     time = etime
@@ -514,313 +589,334 @@ class Node:
         return time, msg
 
     def handle_message(self, msg):
-        # Handles the received messages acording to their types.
-        msgType = msg.flags & 0x0f # first half is the type
-
-        if msgType is UOARTypes.COMMON_DATA:
+        # Handles the received messages acording to their types (first half
+        # of the flags byte), using the handlers table.
+        handler = self.handlers[msg.flags & 0x0f]
+        if handler is None:
             if self.verbose:
-                print('Handling data message from node ' + str(msg.src))
-
-            innerMsg = msg.payload
-            innerMsg.ttl -= 1
-            if innerMsg.dst is not self.addr:
-                if innerMsg.ttl is not 0:
-                    if self.state is UOARState.CLUSTER_MEMBER:
-                        msg = MG.create_optical_datamsg(self.addr,
-                                                        self.nextHop,
-                                                        innerMsg,
-                                                        self.clock.read())
-                    else:
-                        msg = MG.create_acoustic_datamsg(self.addr,
-                                                         self.nextHop,
-                                                         innerMsg,
-                                                         self.clock.read())
-                    self.outbox.append([msg, 0])
-                else:
-                    if self.verbose:
-                        print('Message droped (TTL reached 0)')
-            self.recvdMsgsCounter += 1
-            if self.isSink is True:
-                # Hops statistics
-                corrCoeff = (self.recvdMsgsCounter - 1) / self.recvdMsgsCounter
-                numHops = BASIC_TTL - innerMsg.ttl
-                if numHops > self.maxNumHops:
-                    self.maxNumHops = numHops
-                self.avgNumHops *= corrCoeff
-                self.avgNumHops += (numHops / self.recvdMsgsCounter) 
-                # Time statistics
-                time = self.clock.read() - innerMsg.ctime
+                print('unknown message type')
+            return
+        handler(self, msg)
+
+    def register_handler(msgType, handler):
+        # Sets the function called as handler(node, msg) for messages of the
+        # type (0x00 to 0x0f). Can be used for new UOARTypes.
+        assert 0 <= msgType <= 0x0f, 'Type must fit in half byte'
+        Node.handlers[msgType] = handler
+
+    def handle_data(self, msg):
+        # Data message: forwards it or, in the sink, updates statistics.
+        if self.verbose:
+            print('Handling data message from node ' + str(msg.src))
+
+        innerMsg = msg.payload
+        innerMsg.ttl -= 1
+        if innerMsg.dst is not self.addr:
+            if innerMsg.ttl is not 0:
+                # Only the hop fields change, so a released carrier is
+                # reused (if any).
+                isAcoustic = self.state is not UOARState.CLUSTER_MEMBER
+                msg = MG.create_carrier(self.addr, self.nextHop, innerMsg,
+                                        self.clock.read(), isAcoustic)
+                self.enqueue([msg, 0])
+            else:
+                self.trace_drop('ttl', innerMsg)
                 if self.verbose:
-                    print('Received (time: ' + str(time) + ')')
-                if time > self.maxTimeSpent:
-                    self.maxTimeSpent = time
-                self.avgTimeSpent *= corrCoeff
-                self.avgTimeSpent += (time / self.recvdMsgsCounter)
-
-        elif msgType is UOARTypes.INFO_ANNOUN:
+                    print('Message droped (TTL reached 0)')
+        self.recvdMsgsCounter += 1
+        if self.isSink is True:
+            # Hops statistics
+            corrCoeff = (self.recvdMsgsCounter - 1) / self.recvdMsgsCounter
+            numHops = BASIC_TTL - innerMsg.ttl
+            if numHops > self.maxNumHops:
+                self.maxNumHops = numHops
+            self.avgNumHops *= corrCoeff
+            self.avgNumHops += (numHops / self.recvdMsgsCounter) 
+            # Time statistics
+            time = self.clock.read() - innerMsg.ctime
             if self.verbose:
-                print('Handling info message from node ' + str(msg.src))
-
-            self.numReachableNodes += 1
-            nodePosition  = msg.payload[0]
-            nodeState = msg.payload[1]
-            nodeHops = msg.payload[2]
-            distFromNode = Tools.distance(self.position, nodePosition)
-            # Adding in lists
-            if nodeState is UOARState.CLUSTER_HEAD:
-                self.cheadList[msg.src] = nodeHops is not INFINITY
+                print('Received (time: ' + str(time) + ')')
+            if time > self.maxTimeSpent:
+                self.maxTimeSpent = time
+            self.avgTimeSpent *= corrCoeff
+            self.avgTimeSpent += (time / self.recvdMsgsCounter)
+
+    def handle_info(self, msg):
+        # Information announcement (position, state and hops).
+        if self.verbose:
+            print('Handling info message from node ' + str(msg.src))
+
+        self.numReachableNodes += 1
+        nodePosition  = msg.payload[0]
+        nodeState = msg.payload[1]
+        nodeHops = msg.payload[2]
+        distFromNode = Tools.distance(self.position, nodePosition)
+        # Adding in lists
+        if nodeState is UOARState.CLUSTER_HEAD:
+            self.cheadList[msg.src] = nodeHops is not INFINITY
+        if distFromNode <= OM.maxrange:
+            self.oneighbors[msg.src] = nodePosition
+            if nodeState is UOARState.CLUSTER_MEMBER and \
+               msg.src not in self.cmemberList:
+                self.cmemberList.add(msg.src)
+        updtFactor = (self.numReachableNodes - 1) / self.numReachableNodes
+        self.avgDistance = self.avgDistance * updtFactor
+        self.avgDistance += (distFromNode / self.numReachableNodes)
+        if distFromNode > self.greaterDistance:
+            self.greaterDistance = distFromNode
+
+        if self.state is UOARState.INITIAL and not self.isSink:
+            # If it is not in a cluster and some neighbor is already
+            # member or a head, join it. It's preferable to join as
+            # a member than as a head. 
             if distFromNode <= OM.maxrange:
-                self.oneighbors[msg.src] = nodePosition
-                if nodeState is UOARState.CLUSTER_MEMBER and \
-                   msg.src not in self.cmemberList:
-                    self.cmemberList.append(msg.src)
-            updtFactor = (self.numReachableNodes - 1) / self.numReachableNodes
-            self.avgDistance = self.avgDistance * updtFactor
-            self.avgDistance += (distFromNode / self.numReachableNodes)
-            if distFromNode > self.greaterDistance:
-                self.greaterDistance = distFromNode
-
-            if self.state is UOARState.INITIAL and not self.isSink:
-                # If it is not in a cluster and some neighbor is already
-                # member or a head, join it. It's preferable to join as
-                # a member than as a head. 
-                if distFromNode <= OM.maxrange:
-                    if nodeState is not UOARState.INITIAL:
-                        currDist = INFINITY
-                        if self.nextHop in self.oneighbors:
-                            nextPos = self.oneighbors[self.nextHop]
-                            currDist = Tools.distance(self.position, nextPos)
-                        if distFromNode < currDist:
-                            self.nextHop = msg.src
-                            self.hopsToSink = INFINITY
+                if nodeState is not UOARState.INITIAL:
+                    currDist = INFINITY
+                    if self.nextHop in self.oneighbors:
+                        nextPos = self.oneighbors[self.nextHop]
+                        currDist = Tools.distance(self.position, nextPos)
+                    if distFromNode < currDist:
+                        self.nextHop = msg.src
+                        self.hopsToSink = INFINITY
 
-                else:
-                    if nodeState is UOARState.CLUSTER_HEAD:
-                        if self.hopsToSink is INFINITY:
-                            if self.nextHop is None:
-                                self.nextHop = msg.src
-                                self.hopsToSink = nodeHops + 1
-                        else:
-                            if (nodeHops + 1) < self.hopsToSink:
-                                self.nextHop = msg.src
-                                self.hopsToSink = nodeHops + 1
-
-            if (self.state is not UOARState.INITIAL and \
-               self.status is not UOARStatus.DISCOVERING) and \
-               nodeState is UOARState.INITIAL:
-                # When a node enters in the network and needs information.
-                # Routing control messages have higher priority than data 
-                # messages.
-                msg = MG.create_iamsg(self.addr, self.position, self.state,
-                                      self.hopsToSink)
-                # Insert the message in que outbox or updates the next ot 
-                # be sent. 
-                if len(self.outbox) is not 0:
-                    firstMsgType = self.outbox[0][0].flags & 0x0f
-                    if firstMsgType is not UOARTypes.INFO_ANNOUN:
-                        self.outbox.insert(0, [msg, 0])
-                    else:
-                        self.outbox[0] = [msg, 0]
-                else:
-                    self.outbox.insert(0, [msg, 0])
-
-        elif msgType is UOARTypes.SCORE_ANNOUN or \
-             msgType is UOARTypes.REP_SCORE:
-            if self.verbose:
-                print('Handling score message from node ' + str(msg.src))
-            
-            nodeScore = msg.payload[0]
-            if msg.src in self.oneighbors and \
-               (self.status is UOARStatus.ANNOUNCING or \
-               self.status is UOARStatus.DISCOVERING or \
-               self.status is UOARStatus.UPDATING):
-                # Cluster heads are nodes with the highest score amoung its 
-                # neighbors (in case of a tie, the node with lowest addr wins) 
-                if (self.highestScore[0] < nodeScore) or \
-                   (self.highestScore[0] == nodeScore and \
-                    self.highestScore[1] > msg.src):
-                    self.highestScore = [nodeScore, msg.src]
-
-        elif msgType is UOARTypes.CLUSTER_ANNOUN:
-            if self.verbose:
-                print('Handling cluster message from node ' + str(msg.src))
-            
-            nodeIsHead = msg.payload[0]
-            if nodeIsHead:
-                # A cluster head node will send its own address in the cluster
-                # announcement payload
-                if msg.src not in self.cheadList:
-                    if self.status is UOARStatus.ELECTING or \
-                       self.status is UOARStatus.ANNOUNCING: 
-                        self.cheadList[msg.src] = False
+            else:
+                if nodeState is UOARState.CLUSTER_HEAD:
+                    if self.hopsToSink is INFINITY:
+                        if self.nextHop is None:
+                            self.nextHop = msg.src
+                            self.hopsToSink = nodeHops + 1
                     else:
-                        self.cheadList[msg.src] = True
-                        
-                if msg.src in self.cmemberList:
-                    self.cmemberList.remove(msg.src)
+                        if (nodeHops + 1) < self.hopsToSink:
+                            self.nextHop = msg.src
+                            self.hopsToSink = nodeHops + 1
+
+        if (self.state is not UOARState.INITIAL and \
+           self.status is not UOARStatus.DISCOVERING) and \
+           nodeState is UOARState.INITIAL:
+            # When a node enters in the network and needs information.
+            # Routing control messages have higher priority than data 
+            # messages.
+            msg = MG.create_iamsg(self.addr, self.position, self.state,
+                                  self.hopsToSink)
+            # Insert the message in que outbox or updates the next ot 
+            # be sent. 
+            if self.outbox.head_type() is UOARTypes.INFO_ANNOUN:
+                self.outbox.replace_head([msg, 0])
             else:
-                if msg.src in self.oneighbors and \
-                   msg.src not in self.cmemberList:
-                    self.cmemberList.append(msg.src)
-                    if msg.src in self.cheadList:
-                        del self.cheadList[msg.src]
-
-            if msg.src in self.oneighbors and \
-               self.status is UOARStatus.DISCOVERING:
-                self.nextHop = msg.src
+                self.enqueue([msg, 0])
 
-        elif msgType is UOARTypes.ROUTE_ANNOUN:
-            if self.verbose:
-                print('Handling route message from node ' + str(msg.src))
-            nodeIsHead   = msg.payload[0]
-            nodeNextHop  = msg.payload[1]
-            nodeHops     = msg.payload[2] + 1
-            nodePosition = msg.payload[3]
-            if self.state is UOARState.CLUSTER_HEAD:
-                if nodeIsHead:
-                    dist = Tools.distance(self.position, nodePosition)
+    def handle_score(self, msg):
+        # Score announcement or reply.
+        if self.verbose:
+            print('Handling score message from node ' + str(msg.src))
+        
+        nodeScore = msg.payload[0]
+        if msg.src in self.oneighbors and \
+           (self.status is UOARStatus.ANNOUNCING or \
+           self.status is UOARStatus.DISCOVERING or \
+           self.status is UOARStatus.UPDATING):
+            # Cluster heads are nodes with the highest score amoung its 
+            # neighbors (in case of a tie, the node with lowest addr wins) 
+            if (self.highestScore[0] < nodeScore) or \
+               (self.highestScore[0] == nodeScore and \
+                self.highestScore[1] > msg.src):
+                self.highestScore = [nodeScore, msg.src]
+
+    def handle_cluster(self, msg):
+        # Cluster announcement (node is head or member).
+        if self.verbose:
+            print('Handling cluster message from node ' + str(msg.src))
+        
+        nodeIsHead = msg.payload[0]
+        if nodeIsHead:
+            # A cluster head node will send its own address in the cluster
+            # announcement payload
+            if msg.src not in self.cheadList:
+                if self.status is UOARStatus.ELECTING or \
+                   self.status is UOARStatus.ANNOUNCING: 
+                    self.cheadList[msg.src] = False
+                else:
                     self.cheadList[msg.src] = True
-                    if self.hopsToSink > nodeHops or \
-                       (self.hopsToSink == nodeHops and \
-                       dist < self.nextHopDist):
-                        self.hopsToSink  = nodeHops
-                        self.nextHop     = msg.src
-                        self.nextHopDist = dist
-                        
-                elif self.isSink is False:
-                    if nodeHops < self.minHopsToSink:
-                        self.minHopsToSink = nodeHops
-                        self.memberAlternative = msg.src
-
-                    if self.nextHop is not None and \
-                       nodeNextHop is not self.addr:
-                        if msg.src in self.oneighbors and \
-                           nodeHops <= (self.hopsToSink + 1):
-                            # better be a member than a head 
-                            # print('Node ' + str(self.addr) + ' was member 2')
-                            # print(nodeIsHead)
-                            # print(nodeNextHop)
-                            # print(nodeHops)
-                            # print(nodePosition)
-                            # print(self.hopsToSink + 1)
-                            self.state = UOARState.CLUSTER_MEMBER
-                            self.nextHop = msg.src
-                            self.hopsToSink = nodeHops
-                            newMsg = MG.create_camsg(self.addr, False,
-                                                     self.position)
-                            self.outbox.insert(0, [newMsg, 0])
-
-            if (self.status is UOARStatus.WAITING or \
-               self.status is UOARStatus.ELECTING) and \
-               self.nextHop is msg.src:
-               # For members
+                    
+            if msg.src in self.cmemberList:
+                self.cmemberList.remove(msg.src)
+        else:
+            if msg.src in self.oneighbors and \
+               msg.src not in self.cmemberList:
+                self.cmemberList.add(msg.src)
+                if msg.src in self.cheadList:
+                    del self.cheadList[msg.src]
+
+        if msg.src in self.oneighbors and \
+           self.status is UOARStatus.DISCOVERING:
+            self.nextHop = msg.src
+
+    def handle_route(self, msg):
+        # Route announcement (hops to sink).
+        if self.verbose:
+            print('Handling route message from node ' + str(msg.src))
+        nodeIsHead   = msg.payload[0]
+        nodeNextHop  = msg.payload[1]
+        nodeHops     = msg.payload[2] + 1
+        nodePosition = msg.payload[3]
+        if self.state is UOARState.CLUSTER_HEAD:
+            if nodeIsHead:
+                dist = Tools.distance(self.position, nodePosition)
+                self.cheadList[msg.src] = True
+                if self.hopsToSink > nodeHops or \
+                   (self.hopsToSink == nodeHops and \
+                   dist < self.nextHopDist):
+                    self.hopsToSink  = nodeHops
+                    self.nextHop     = msg.src
+                    self.nextHopDist = dist
+                    
+            elif self.isSink is False:
                 if nodeHops < self.minHopsToSink:
                     self.minHopsToSink = nodeHops
-                    newMsg = MG.create_ramsg(self.addr, False, self.nextHop, 
-                                             nodeHops, self.position)
-                    self.outbox.insert(0, [newMsg, 0])
-                self.stopWaiting = True  
-
-        elif msgType is UOARTypes.REQ_SCORE:
-            if self.verbose:
-                print('Handling req score msg from ' + str(msg.src))
-
-            if msg.src in self.oneighbors:
-                # self.score = self.calculate_score()
-                # newMsg = MG.create_rpsmsg(self.addr, msg.src, self.score)
-                score = self.calculate_score()
-                newMsg = MG.create_rpsmsg(self.addr, msg.src, score)
-                if len(self.outbox) is not 0:
-                    firstMsgType = self.outbox[0].flags & 0x0f
-                    if firstMsgType is not UOARTypes.REP_SCORE:
-                        self.outbox.insert(0, [newMsg, 0])
-                    else:
-                        self.outbox[0] = [newMsg, 0]
-                else:
-                    self.outbox.append([newMsg, 0])
-
-        elif msgType is UOARTypes.UPDATE_INFO:
-            if self.verbose:
-                print('Handling update info msg from ' + str(msg.src))
-
-            newHead = msg.payload[0]
-            newNextHop = msg.payload[1]
-            if newHead is self.addr:
-                # Must be a head now
-                self.state = UOARState.CLUSTER_HEAD
-                self.nextHop = newNextHop
+                    self.memberAlternative = msg.src
+
+                if self.nextHop is not None and \
+                   nodeNextHop is not self.addr:
+                    if msg.src in self.oneighbors and \
+                       nodeHops <= (self.hopsToSink + 1):
+                        # better be a member than a head 
+                        # print('Node ' + str(self.addr) + ' was member 2')
+                        # print(nodeIsHead)
+                        # print(nodeNextHop)
+                        # print(nodeHops)
+                        # print(nodePosition)
+                        # print(self.hopsToSink + 1)
+                        self.state = UOARState.CLUSTER_MEMBER
+                        self.nextHop = msg.src
+                        self.hopsToSink = nodeHops
+                        newMsg = MG.create_camsg(self.addr, False,
+                                                 self.position)
+                        self.enqueue([newMsg, 0])
+
+        if (self.status is UOARStatus.WAITING or \
+           self.status is UOARStatus.ELECTING) and \
+           self.nextHop is msg.src:
+           # For members
+            if nodeHops < self.minHopsToSink:
+                self.minHopsToSink = nodeHops
+                newMsg = MG.create_ramsg(self.addr, False, self.nextHop, 
+                                         nodeHops, self.position)
+                self.enqueue([newMsg, 0])
+            self.stopWaiting = True  
+
+    def handle_req_score(self, msg):
+        # Request of score (cluster head update).
+        if self.verbose:
+            print('Handling req score msg from ' + str(msg.src))
+
+        if msg.src in self.oneighbors:
+            # self.score = self.calculate_score()
+            # newMsg = MG.create_rpsmsg(self.addr, msg.src, self.score)
+            score = self.calculate_score()
+            newMsg = MG.create_rpsmsg(self.addr, msg.src, score)
+            if self.outbox.head_type() is UOARTypes.REP_SCORE:
+                self.outbox.replace_head([newMsg, 0])
             else:
-                if self.nextHop is msg.src or newHead in self.oneighbors:
-                    # Must update which node is the next hop
-                    ##################################################
-                    ## Might be a problem is new head is out of range
-                    ##################################################
-                    self.nextHop = newHead
-                self.cheadList[newHead] = True
-
-            if newHead in self.oneighbors:
-                self.cmemberList.remove(msg.payload[0])
-
+                self.enqueue([newMsg, 0])
+
+    def handle_update_info(self, msg):
+        # New cluster head.
+        if self.verbose:
+            print('Handling update info msg from ' + str(msg.src))
+
+        newHead = msg.payload[0]
+        newNextHop = msg.payload[1]
+        if newHead is self.addr:
+            # Must be a head now
+            self.state = UOARState.CLUSTER_HEAD
+            self.nextHop = newNextHop
+        else:
+            if self.nextHop is msg.src or newHead in self.oneighbors:
+                # Must update which node is the next hop
+                ##################################################
+                ## Might be a problem is new head is out of range
+                ##################################################
+                self.nextHop = newHead
+            self.cheadList[newHead] = True
+
+        if newHead in self.oneighbors:
+            self.cmemberList.remove(msg.payload[0])
+
+        if msg.src in self.oneighbors:
+            self.cmemberList.add(msg.src)
+
+        del self.cheadList[msg.src]
+
+        if self.verbose:
+            print(self.cheadList)
+            print(self.cmemberList)
+
+    def handle_req_rinfo(self, msg):
+        # Request of route info (next hop is dead).
+        if self.verbose:
+            print('Handling route info request msg from ' + str(msg.src))
+
+        if msg.src is not self.nextHop and \
+           msg.payload[0] is not self.nextHop:
+            # Only replies if the requester is not its own next hop and  
+            # they don't share the same next hop. (-_- can't help)
+            
             if msg.src in self.oneighbors:
-                self.cmemberList.append(msg.src)
-
-            del self.cheadList[msg.src]
-
-            if self.verbose:
-                print(self.cheadList)
-                print(self.cmemberList)
-
-        elif msgType is UOARTypes.REQ_RINFO:
-            if self.verbose:
-                print('Handling route info request msg from ' + str(msg.src))
-
-            if msg.src is not self.nextHop and \
-               msg.payload[0] is not self.nextHop:
-                # Only replies if the requester is not its own next hop and  
-                # they don't share the same next hop. (-_- can't help)
-                
-                if msg.src in self.oneighbors:
-                    newMsg = MG.create_optical_rprmsg(self.addr, msg.src,
-                                                      self.nextHop,
-                                                      self.hopsToSink)
-                else:
-                    newMsg = MG.create_acoustic_rprmsg(self.addr, msg.src,
-                                                       self.nextHop,
-                                                       self.hopsToSink)
-                self.outbox.insert(0, [newMsg, 0])        
-
-        elif msgType is UOARTypes.REP_RINFO:
-            if self.verbose:
-                print('Handling route info reply from ' + str(msg.src))
-
-            if self.status is UOARStatus.RECOVERING:
-                nodeNextHop = msg.payload[0]
-                nodeHopsToSink = msg.payload[1]
-                replier = msg.src
-                if replier in self.oneighbors:
-                    self.nextHop = msg.src
-                    self.hopsToSink = INFINITY
-                    print('Node ' + str(self.addr) + ' was member 3')
-                    self.state = UOARState.CLUSTER_MEMBER
-
-                if self.state is UOARState.CLUSTER_HEAD and \
-                   self.hopsToSink >= nodeHopsToSink:
-                    self.nextHop = msg.src
-                    self.hopsToSink = nodeHopsToSink + 1
-
-        elif msgType is UOARTypes.ACK:
-            if self.verbose:
-                print('Handling ACK from node ' + str(msg.src))
-
-            if self.waitingACK:
-                self.outbox.pop(0)
-                self.waitingACK = False
-                if self.msgsLostCount is not 0:
-                    self.msgsLostCount = 0
+                newMsg = MG.create_optical_rprmsg(self.addr, msg.src,
+                                                  self.nextHop,
+                                                  self.hopsToSink)
             else:
-                if self.verbose:
-                    print('error: unknown ack received')
+                newMsg = MG.create_acoustic_rprmsg(self.addr, msg.src,
+                                                   self.nextHop,
+                                                   self.hopsToSink)
+            self.enqueue([newMsg, 0])
+
+    def handle_rep_rinfo(self, msg):
+        # Reply of route info.
+        if self.verbose:
+            print('Handling route info reply from ' + str(msg.src))
+
+        if self.status is UOARStatus.RECOVERING:
+            nodeNextHop = msg.payload[0]
+            nodeHopsToSink = msg.payload[1]
+            replier = msg.src
+            if replier in self.oneighbors:
+                self.nextHop = msg.src
+                self.hopsToSink = INFINITY
+                print('Node ' + str(self.addr) + ' was member 3')
+                self.state = UOARState.CLUSTER_MEMBER
 
+            if self.state is UOARState.CLUSTER_HEAD and \
+               self.hopsToSink >= nodeHopsToSink:
+                self.nextHop = msg.src
+                self.hopsToSink = nodeHopsToSink + 1
+
+    def handle_ack(self, msg):
+        # ACK of the last sent message.
+        if self.verbose:
+            print('Handling ACK from node ' + str(msg.src))
+
+        if self.waitingACK:
+            amsg = (self.outbox.pop_head())[0]
+            if (amsg.flags & 0x0f) is UOARTypes.COMMON_DATA:
+                MG.release_carrier(amsg)
+            self.waitingACK = False
+            if self.msgsLostCount is not 0:
+                self.msgsLostCount = 0
         else:
             if self.verbose:
-                print('unknown message type')
+                print('error: unknown ack received')
+
+# Handlers of each message type (indexed by type)
+Node.handlers = [None] * 0x10
+Node.register_handler(UOARTypes.COMMON_DATA, Node.handle_data)
+Node.register_handler(UOARTypes.ACK, Node.handle_ack)
+Node.register_handler(UOARTypes.INFO_ANNOUN, Node.handle_info)
+Node.register_handler(UOARTypes.SCORE_ANNOUN, Node.handle_score)
+Node.register_handler(UOARTypes.CLUSTER_ANNOUN, Node.handle_cluster)
+Node.register_handler(UOARTypes.ROUTE_ANNOUN, Node.handle_route)
+Node.register_handler(UOARTypes.REQ_SCORE, Node.handle_req_score)
+Node.register_handler(UOARTypes.REP_SCORE, Node.handle_score)
+Node.register_handler(UOARTypes.UPDATE_INFO, Node.handle_update_info)
+Node.register_handler(UOARTypes.REQ_RINFO, Node.handle_req_rinfo)
+Node.register_handler(UOARTypes.REP_RINFO, Node.handle_rep_rinfo)
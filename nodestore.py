@@ -0,0 +1,101 @@
+###############################################################################
+##  Laboratorio de Engenharia de Computadores (LECOM),                       ##
+##  Universidade Federal de Minas Gerais (UFMG).                             ##
+##                                                                           ##
+##  TODO:                                                                    ##
+##                                                                           ##
+##  Author: Eduardo Pinto                                                    ##
+###############################################################################
+
+import numpy as np
+
+from node import Node
+
+class NodeStore:
+    # Struct-of-arrays with the hot scalar fields of many nodes (one row per
+    # node). Attached nodes read and write their fields in the arrays, so
+    # questions about the whole network are answered without looping over
+    # the nodes.
+    fields = {
+        'energy'           : np.float64,
+        'maxEnergy'        : np.float64,
+        'state'            : np.int8,
+        'status'           : np.int8,
+        'recvdMsgsCounter' : np.int64,
+        'sentMsgsCounter'  : np.int64,
+        'msgsDroppedCount' : np.int64,
+    }
+
+    def __init__(self, capacity = 1024):
+        assert capacity > 0, 'Capacity must be > 0'
+        self.size = 0
+        self.addrs = np.zeros(capacity, dtype=np.int64)
+        for name, dtype in self.fields.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+
+    def __grow(self):
+        capacity = 2 * len(self.addrs)
+        for name in ['addrs'] + list(self.fields.keys()):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def attach(self, node):
+        # Moves the fields of the node to a new row. The node keeps working
+        # as before, but its fields are views into the arrays.
+        assert not isinstance(node, StoredNode), 'Node is already attached'
+        if self.size == len(self.addrs):
+            self.__grow()
+        row = self.size
+        self.size += 1
+        self.addrs[row] = node.addr
+        for name in self.fields.keys():
+            getattr(self, name)[row] = node.__dict__.pop(name)
+        node.store = self
+        node.row = row
+        node.__class__ = StoredNode
+        return row
+
+    def alive(self):
+        # Mask of the nodes with energy
+        return self.energy[:self.size] > 0
+
+    def alive_addrs(self):
+        return self.addrs[:self.size][self.alive()]
+
+    def total_energy(self):
+        return self.energy[:self.size].sum()
+
+    def consume(self, energies):
+        # Removes energy of all nodes at once (array with one value per row,
+        # or a single value). Nodes without energy are not affected.
+        alive = self.alive()
+        energies = np.broadcast_to(energies, (self.size,))
+        self.energy[:self.size][alive] -= energies[alive]
+
+    def snapshot(self):
+        # Copy of all fields (name -> array), including the addresses.
+        snap = {'addrs': self.addrs[:self.size].copy()}
+        for name in self.fields.keys():
+            snap[name] = getattr(self, name)[:self.size].copy()
+        return snap
+
+def stored_field(name, convert):
+    # Property that reads/writes the field in the row of the node. Values are
+    # converted back to Python types (the node compares states with 'is').
+    def get(node):
+        return convert(getattr(node.store, name)[node.row])
+    def set(node, value):
+        getattr(node.store, name)[node.row] = value
+    return property(get, set)
+
+class StoredNode(Node):
+    # Node whose hot fields are kept in a NodeStore (see NodeStore.attach).
+    energy           = stored_field('energy', float)
+    maxEnergy        = stored_field('maxEnergy', float)
+    state            = stored_field('state', int)
+    status           = stored_field('status', int)
+    recvdMsgsCounter = stored_field('recvdMsgsCounter', int)
+    sentMsgsCounter  = stored_field('sentMsgsCounter', int)
+    msgsDroppedCount = stored_field('msgsDroppedCount', int)
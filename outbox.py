@@ -0,0 +1,140 @@
+###############################################################################
+##  Laboratorio de Engenharia de Computadores (LECOM),                       ##
+##  Universidade Federal de Minas Gerais (UFMG).                             ##
+##                                                                           ##
+##  TODO:                                                                    ##
+##                                                                           ##
+##  Author: Eduardo Pinto                                                    ##
+###############################################################################
+
+from collections import deque
+
+from messages import UOARTypes
+
+# What is discarded when the outbox is full
+class DropPolicy:
+    DROP_TAIL        = 0 # the new message (or the newest data message)
+    DROP_HEAD        = 1 # the next message to be sent
+    DROP_OLDEST_DATA = 2 # the oldest data message
+
+class Outbox:
+    # Messages waiting to be sent by a node, as pairs [msg, number of
+    # transmissions]. Control messages have their own lane and always go
+    # before data messages. The newest control message goes first and data
+    # messages are sent in arrival order. All head operations are O(1).
+    # The outbox may be limited in number of messages and/or bytes.
+    def __init__(self, maxMsgs = None, maxBytes = None, 
+                 policy = DropPolicy.DROP_TAIL):
+        self.control = deque()
+        self.data    = deque()
+        self.numBytes = 0
+        self.numDropped = 0
+        self.set_capacity(maxMsgs, maxBytes, policy)
+
+    def set_capacity(self, maxMsgs, maxBytes, policy = DropPolicy.DROP_TAIL):
+        # None means no limit.
+        assert maxMsgs is None or maxMsgs > 0, 'Capacity must be > 0'
+        assert maxBytes is None or maxBytes > 0, 'Capacity must be > 0'
+        self.maxMsgs  = maxMsgs
+        self.maxBytes = maxBytes
+        self.policy   = policy
+
+    def __len__(self):
+        return len(self.control) + len(self.data)
+
+    def __iter__(self):
+        # In sending order
+        for pair in self.control:
+            yield pair
+        for pair in self.data:
+            yield pair
+
+    def __getitem__(self, index):
+        if index < len(self.control):
+            return self.control[index]
+        return self.data[index - len(self.control)]
+
+    def is_control(msg):
+        return (msg.flags & 0x0f) is not UOARTypes.COMMON_DATA
+
+    def is_full(self):
+        return (self.maxMsgs is not None and len(self) > self.maxMsgs) or \
+               (self.maxBytes is not None and self.numBytes > self.maxBytes)
+
+    def push(self, pair):
+        # Control messages go to the front, data messages to the end. Returns
+        # the list of pairs dropped to respect the capacity. Pairs already 
+        # transmitted (waiting for an ACK or a retry) and the new pair, under
+        # DROP_HEAD, are never dropped, so the outbox may stay above its
+        # capacity until they leave.
+        if Outbox.is_control(pair[0]):
+            self.control.appendleft(pair)
+        else:
+            self.data.append(pair)
+        self.numBytes += len(pair[0])
+        dropped = []
+        while self.is_full():
+            victim = self.find_victim(pair)
+            if victim is None:
+                break
+            lane, index = victim
+            dropped.append(lane[index])
+            del lane[index]
+            self.numBytes -= len(dropped[-1][0])
+        self.numDropped += len(dropped)
+        return dropped
+
+    def find_victim(self, new):
+        # (lane, index) of the pair to drop according to the policy (None if
+        # no pair can be dropped).
+        if self.policy is DropPolicy.DROP_HEAD:
+            # Next message to be sent, besides the new one
+            for lane in (self.control, self.data):
+                for index, pair in enumerate(lane):
+                    if pair is not new and pair[1] == 0:
+                        return lane, index
+            return None
+        # Control messages are only dropped from the head
+        if self.policy is DropPolicy.DROP_TAIL:
+            indexes = range(len(self.data) - 1, -1, -1)
+        else:
+            indexes = range(len(self.data))
+        for index in indexes:
+            if self.data[index][1] == 0:
+                return self.data, index
+        return None
+
+    def head(self):
+        # Next pair to be sent (None if empty)
+        if len(self.control) != 0:
+            return self.control[0]
+        if len(self.data) != 0:
+            return self.data[0]
+        return None
+
+    def head_type(self):
+        # Type of the next message (None if empty)
+        pair = self.head()
+        if pair is None:
+            return None
+        return pair[0].flags & 0x0f
+
+    def pop_head(self):
+        if len(self.control) != 0:
+            pair = self.control.popleft()
+        else:
+            pair = self.data.popleft()
+        self.numBytes -= len(pair[0])
+        return pair
+
+    def replace_head(self, pair):
+        # Replaces the next pair (must be in the same lane).
+        if len(self.control) != 0:
+            assert Outbox.is_control(pair[0]), 'Lanes can not be mixed'
+            self.numBytes -= len(self.control[0][0])
+            self.control[0] = pair
+        else:
+            assert not Outbox.is_control(pair[0]), 'Lanes can not be mixed'
+            self.numBytes -= len(self.data[0][0])
+            self.data[0] = pair
+        self.numBytes += len(pair[0])
@@ -0,0 +1,118 @@
+###############################################################################
+##  Laboratorio de Engenharia de Computadores (LECOM),                       ##
+##  Universidade Federal de Minas Gerais (UFMG).                             ##
+##                                                                           ##
+##  Opt-in profiling of the simulation: number of calls and time spent in   ##
+##  Node.execute (by status), Node.handle_message (by message type), in the ##
+##  link caches and in the channel models. Usage:                            ##
+##      sim.profiler = Profiler()                                            ##
+##      sim.start(stopExec) # report is printed with the other statistics    ##
+##                                                                           ##
+##  Author: Eduardo Pinto                                                    ##
+###############################################################################
+
+from time import perf_counter
+
+from messages import UOARTypes
+from node import UOARStatus
+
+def constant_names(constants):
+    # value -> name of the constants of a class (as UOARStatus)
+    return dict((value, name) for name, value in vars(constants).items()
+                if not name.startswith('_') and isinstance(value, int))
+
+class Profiler:
+    # Methods are measured by replacing them, in each object, by a wrapper
+    # that updates the counters. Nothing is changed while the profiler is
+    # not attached, so there is no cost when profiling is off. The time of
+    # the link caches includes the calls of the channel models (on misses),
+    # so they are separate groups (percentages are within each group).
+    groups = [
+        ('Node.execute', constant_names(UOARStatus)),
+        ('Node.handle_message', constant_names(UOARTypes)),
+        ('link cache', None),
+        ('channel', None),
+    ]
+
+    def __init__(self):
+        self.counters = {} # (group, key) -> [number of calls, time]
+        self.wrapped = [] # (object, method name) of the wrappers
+
+    def wrap(self, obj, method, group, key_of, keyAfter = False):
+        # Replaces obj.method by a wrapper that measures it. key_of(obj, args)
+        # gives the key of the call in the group, taken after the call if 
+        # keyAfter is True.
+        original = getattr(obj, method)
+        counters = self.counters
+        def wrapper(*args):
+            if not keyAfter:
+                key = (group, key_of(obj, args))
+            begin = perf_counter()
+            result = original(*args)
+            elapsed = perf_counter() - begin
+            if keyAfter:
+                key = (group, key_of(obj, args))
+            counter = counters.get(key)
+            if counter is None:
+                counters[key] = [1, elapsed]
+            else:
+                counter[0] += 1
+                counter[1] += elapsed
+            return result
+        setattr(obj, method, wrapper)
+        self.wrapped.append((obj, method))
+
+    def attach(self, sim):
+        # Measures the nodes and channels of the simulator (nodes added
+        # after a previous attach included).
+        done = set(id(obj) for obj, _ in self.wrapped)
+        for node in sim.nodesRef.values():
+            if id(node) in done:
+                continue
+            # (by the status after the call: the node changes its status at
+            # the beginning of the slot, before the work of the new phase)
+            self.wrap(node, 'execute', 'Node.execute',
+                      lambda node, args: node.status, True)
+            self.wrap(node, 'handle_message', 'Node.handle_message',
+                      lambda node, args: args[0].flags & 0x0f)
+        if id(sim) not in done:
+            # Link caches and channel models (only called on cache misses)
+            self.wrap(sim, 'link_per', 'link cache', 
+                      lambda sim, args: 'link_per')
+            self.wrap(sim, 'broadcast_per', 'link cache',
+                      lambda sim, args: 'broadcast_per')
+            self.wrap(sim.achannel, 'per', 'channel',
+                      lambda channel, args: 'AcousticChannel.per')
+            self.wrap(sim.achannel, 'per_many', 'channel',
+                      lambda channel, args: 'AcousticChannel.per_many')
+            self.wrap(sim.ochannel, 'per', 'channel',
+                      lambda channel, args: 'OpticalChannel.per')
+
+    def detach(self):
+        # Puts back the original methods (counters are kept).
+        for obj, method in self.wrapped:
+            delattr(obj, method)
+        self.wrapped = []
+
+    def reset(self):
+        self.counters.clear()
+
+    def report(self):
+        # Lines of the report: for each group, calls and time of each key
+        # (most expensive first).
+        lines = []
+        for group, names in self.groups:
+            rows = [(key, counter) for (g, key), counter
+                    in self.counters.items() if g == group]
+            if len(rows) == 0:
+                continue
+            total = sum(counter[1] for _, counter in rows)
+            lines.append('%-24s %10s %10s %10s %6s' % (group, 'calls',
+                         'time (s)', 'us/call', '%'))
+            rows.sort(key=lambda row: -row[1][1])
+            for key, (calls, elapsed) in rows:
+                name = key if names is None else names.get(key, str(key))
+                lines.append('  %-22s %10d %10.3f %10.2f %6.1f' % (name, calls,
+                             elapsed, 1.0e6 * elapsed / calls,
+                             100.0 * elapsed / total if total > 0 else 0))
+        return lines
@@ -11,14 +11,40 @@ from channels import AcousticChannel, OpticalChannel
 from messages import *
 from modens import AcousticModem as AM
 from modens import OpticalModem as OM
-from node import Node
-from tools import Tools, Clock, INFINITY
+from heapq import heappush, heappop
+from node import Node, UOARStatus
+from outbox import DropPolicy
+from random import random, getrandbits, getstate, setstate
+from tools import Tools, Clock, SpatialIndex, RNGStream, INFINITY
+from tracer import TraceEvent
+
+import gzip
+import os
+import pickle
+
+import numpy as np
+
+
+class CheckpointPickler(pickle.Pickler):
+    # The nodes compare values with INFINITY using 'is', so the object itself
+    # must come back from a checkpoint (not just an infinite float).
+    def persistent_id(self, obj):
+        if obj is INFINITY:
+            return 'INFINITY'
+        return None
+
+class CheckpointUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        if pid == 'INFINITY':
+            return INFINITY
+        raise pickle.UnpicklingError('Unknown persistent id: ' + str(pid))
 
 
 class Simulator:
     beta = 0
     def __init__(self, verbose = False):
         self.packetSize   = 0
+        self.virtualPayload = False # payloads only have a size (no content)
         self.timeInterval = None
         # channels
         self.achannel = AcousticChannel(k = 2.0, s = 0.0, w = 0.0)
@@ -34,16 +60,50 @@ class Simulator:
         self.appStart    = INFINITY
         self.appInterval = INFINITY
         self.appStop     = INFINITY 
+        # outbox capacity of each node (None means no limit)
+        self.outboxMaxMsgs  = None
+        self.outboxMaxBytes = None
+        self.dropPolicy     = DropPolicy.DROP_TAIL
         # control
         self.clock = Clock()
         self.verbose = verbose
+        self.tracer = None # Tracer of events (see set_tracer)
+        self.traceMask = TraceEvent.NONE
+        self.lastStates = {} # addr -> last traced (state, status)
+        self.profiler = None # Profiler (optional, report in print_data)
+        # checkpoints (the state is saved in checkpointFile every 
+        # checkpointInterval slots, see save_checkpoint)
+        self.checkpointFile = None
+        self.checkpointInterval = None
+        self.pendingSlots = 0 # slots left of the current start
+        self.slotsRun = 0 # slots run since the beginning
+        self.eventDriven = False # skips the slots where nothing can happen
+        self.spatialReuse = False # nodes far apart share the same slot
+        self.fastForward = True # TDMA jumps over slots where all nodes idle
+        self.slotGroups = None # nodes (indexes) of each slot in spatial reuse
+        self.touched = None # addrs of nodes that received messages (when set)
+        # Generator for batched draws (seeded from the random module when
+        # the simulation starts, so random.seed keeps runs reproducible)
+        self.rng = None
+        # If seed is set, the simulation does not use the random module: each
+        # link (and each broadcast source) has its own stream derived from 
+        # the seed, so two configurations with the same seed see the same 
+        # channel luck on the same links (common random numbers).
+        self.seed = None
+        self.streams = {} # (kind, src, dst, is acoustic) -> stream state
         self.firstNode = 0
+        self.firstGroup = 0 # same as firstNode, in spatial reuse
         # node control
         self.nodesUpdated = True
         self.numNodes   = 0
         self.nodesRef   = {} # __
+        self.store      = None # NodeStore for the node fields (optional, must
+                               # be set before adding nodes)
         self.aneighbors = {} # __
         self.oneighbors = {} # __
+        self.linkCache  = {} # (src, dst, is acoustic, length) -> PER
+                             # (dst is BROADCAST_ADDR for the array of PERs
+                             # to all acoustic neighbors of src)
         # statistics
         self.atransmissions = 0
         self.otransmissions = 0
@@ -52,35 +112,200 @@ class Simulator:
         #
         assert addr is not BROADCAST_ADDR, 'Node can\' t have broadcast addr'
         node = Node(addr, x, y, depth, energy, self.clock, self.verbose)
-        self.nodesRef[addr] = node
-        self.nodesUpdated = False
+        self.add_node(node)
     
     def add_node(self, node):
         #
         assert node.__class__.__name__ is 'Node', 'Node must be of class Node'
         assert node.addr is not BROADCAST_ADDR, 'Node addr is invalid (addr=0)'
+        if self.store is not None:
+            self.store.attach(node)
+        node.onMove = self.node_moved
+        node.tracer = self.tracer
+        self.lastStates[node.addr] = (node.state, node.status)
         self.nodesRef[node.addr] = node
         self.nodesUpdated = False
 
+    def set_tracer(self, tracer):
+        # Events of the simulation and of all nodes go to tracer (None turns
+        # tracing off).
+        self.tracer = tracer
+        self.traceMask = TraceEvent.NONE if tracer is None else tracer.mask
+        for node in self.nodesRef.values():
+            node.tracer = tracer
+            self.lastStates[node.addr] = (node.state, node.status)
+
+    def trace_state(self, node):
+        # Writes the state of the node if it changed since the last check.
+        current = (node.state, node.status)
+        if self.lastStates.get(node.addr) != current:
+            self.lastStates[node.addr] = current
+            self.tracer.emit(TraceEvent.STATE, self.clock.read(), node.addr,
+                             current[0], current[1])
+
     # necessary for broadcast
     def update_nodes_info(self):
+        # Neighbors are found with range queries over a grid (one for each 
+        # modem range) instead of comparing every pair of nodes.
         if self.verbose: 
             print('Updating nodes information')
         self.numNodes = len(self.nodesRef)
-        for addr1 in self.nodesRef.keys():
-            aneighbors = []
-            oneighbors = []
-            for addr2 in self.nodesRef.keys():
-                if addr1 is not addr2:
-                    node1 = self.nodesRef[addr1]
-                    node2 = self.nodesRef[addr2]
-                    distance = Tools.distance(node1.position, node2.position)
-                    if distance <= AM.maxrange:
-                        aneighbors.append(addr2)
-                    if distance <= OM.maxrange:
-                        oneighbors.append(addr2)
-            self.aneighbors[addr1] = aneighbors
-            self.oneighbors[addr1] = oneighbors
+        aindex = SpatialIndex(AM.maxrange)
+        oindex = SpatialIndex(OM.maxrange)
+        for addr, node in self.nodesRef.items():
+            aindex.insert(addr, node.position)
+            oindex.insert(addr, node.position)
+        changed = set() # addrs whose acoustic neighbors changed
+        for addr, node in self.nodesRef.items():
+            neighbors = aindex.query(node.position, AM.maxrange, addr)
+            if self.aneighbors.get(addr) != neighbors:
+                changed.add(addr)
+            self.aneighbors[addr] = neighbors
+            self.oneighbors[addr] = oindex.query(node.position, OM.maxrange,
+                                                 addr)
+        # PERs of links only depend on the positions of their nodes (moves
+        # clear the cache, see node_moved), but the PERs of a broadcast are
+        # for the neighbors of its source.
+        for key in [key for key in self.linkCache 
+                    if key[1] == BROADCAST_ADDR and key[0] in changed]:
+            del self.linkCache[key]
+        if self.slotGroups is not None:
+            # The rotation only starts again if the groups changed
+            groups = self.color_nodes(list(self.nodesRef.values()))
+            if groups != self.slotGroups:
+                self.slotGroups = groups
+                self.firstGroup = 0
+        self.nodesUpdated = True
+
+    def color_nodes(self, nodesList):
+        # Greedy coloring of the two-hop acoustic interference graph: nodes 
+        # with the same color are not neighbors and do not share neighbors, 
+        # so they can transmit at the same time without collisions. Returns 
+        # the list of node indexes of each color.
+        indexOf = dict((node.addr, i) for i, node in enumerate(nodesList))
+        colors = [None] * len(nodesList)
+        groups = []
+        # Nodes with more neighbors first (Welsh-Powell order)
+        order = sorted(range(len(nodesList)), 
+                       key=lambda i: -len(self.aneighbors[nodesList[i].addr]))
+        for i in order:
+            used = set()
+            for addr1 in self.aneighbors[nodesList[i].addr]:
+                used.add(colors[indexOf[addr1]])
+                for addr2 in self.aneighbors[addr1]:
+                    used.add(colors[indexOf[addr2]])
+            color = 0
+            while color in used:
+                color += 1
+            colors[i] = color
+            if color == len(groups):
+                groups.append([])
+            groups[color].append(i)
+        for group in groups:
+            group.sort()
+        return groups
+
+    def node_moved(self, node):
+        # Distances changed, so neighbors and link qualities are outdated.
+        self.nodesUpdated = False
+        self.linkCache.clear()
+
+    def link_per(self, src, dst, isAcoustic, length):
+        # Packet error rate of the link. It is calculated only once for each
+        # (src, dst, medium, length) since nodes rarely move.
+        key = (src, dst, isAcoustic, length)
+        per = self.linkCache.get(key)
+        if per is None:
+            dist = Tools.distance(self.nodesRef[src].position, 
+                                  self.nodesRef[dst].position)
+            if isAcoustic:
+                per = self.achannel.per(AM.frequency, AM.txPower, dist, length)
+            else:
+                per = self.ochannel.per(OM.txPower, dist, dist, self.beta, 
+                                        length)
+            self.linkCache[key] = per
+        return per
+
+    def broadcast_per(self, src, length):
+        # Array of packet error rates from src to each one of its acoustic 
+        # neighbors (same order of self.aneighbors[src]).
+        key = (src, BROADCAST_ADDR, True, length)
+        per = self.linkCache.get(key)
+        if per is None:
+            srcPos = self.nodesRef[src].position
+            distances = [Tools.distance(srcPos, self.nodesRef[dst].position) 
+                         for dst in self.aneighbors[src]]
+            per = self.achannel.per_many(distances, length, AM.frequency, 
+                                         AM.txPower)
+            self.linkCache[key] = per
+        return per
+
+    def stream(self, kind, *key):
+        # NumPy generator of an independent stream of the simulation seed.
+        assert self.seed is not None, 'Simulation seed is not set'
+        return np.random.default_rng(Tools.stream_seed(self.seed, kind, *key))
+
+    def topology_rng(self):
+        # Generator for Tools.distribute_nodes (same seed, same positions).
+        return self.stream(RNGStream.TOPOLOGY)
+
+    def link_draw(self, src, dst, isAcoustic):
+        # Uniform number in [0, 1) for a transmission from src to dst.
+        if self.seed is None:
+            return random()
+        key = (RNGStream.LINK, src, dst, isAcoustic)
+        state = self.streams.get(key)
+        if state is None:
+            state = Tools.stream_state(self.seed, *key)
+        self.streams[key], draw = Tools.uniform(state)
+        return draw
+
+    def broadcast_draws(self, src, size):
+        # Array of size uniform numbers for a broadcast of src.
+        if self.seed is None:
+            return self.rng.random(size)
+        key = (RNGStream.BROADCAST, src, BROADCAST_ADDR, True)
+        state = self.streams.get(key)
+        if state is None:
+            state = Tools.stream_state(self.seed, *key)
+        self.streams[key], draws = Tools.uniforms(state, size)
+        return draws
+
+    def deliver(self, dst, msg):
+        # Puts the message in the destination node.
+        if self.touched is not None:
+            self.touched.add(dst)
+        node = self.nodesRef[dst]
+        result = node.recv_msg(msg)
+        if self.traceMask & (TraceEvent.RECV | TraceEvent.STATE):
+            if self.traceMask & TraceEvent.RECV:
+                self.tracer.emit(TraceEvent.RECV, self.clock.read(), dst,
+                                 msg.src, msg.flags & 0x0f)
+            if self.traceMask & TraceEvent.STATE:
+                self.trace_state(node)
+        return result
+
+    def deliver_broadcast(self, msg):
+        # Delivers a broadcast to all acoustic neighbors at once: the success
+        # of every reception is drawn in a single batch and only the nodes 
+        # that got the message are called.
+        destinations = self.aneighbors[msg.src]
+        self.atransmissions += 1 + len(destinations)
+        if len(destinations) == 0:
+            return
+        per = self.broadcast_per(msg.src, len(msg))
+        success = self.broadcast_draws(msg.src, len(destinations)) >= per
+        if self.traceMask & TraceEvent.SEND:
+            self.tracer.emit(TraceEvent.SEND, self.clock.read(), msg.src, 
+                             msg.dst, msg.flags & 0x0f, len(msg), True, 
+                             success.sum())
+        for dst, got in zip(destinations, success):
+            if got:
+                if self.verbose:
+                    print('Node ' + str(dst) + ' received broadcast')
+                self.deliver(dst, msg)
+            elif self.verbose:
+                print('Failed to send to ' + str(dst))
 
     def create_app_msgs(self):
         # Method to feed the routing algorithm with application messages.
@@ -88,22 +313,334 @@ class Simulator:
             if node.energy > 0 and node.isSink is False:
                 node.application_generate_msg()
 
+    def num_alive_nodes(self):
+        if self.store is not None:
+            return int(self.store.alive().sum())
+        return sum(1 for node in self.nodesRef.values() if node.energy > 0)
+
+    def total_energy(self):
+        if self.store is not None:
+            return float(self.store.total_energy())
+        return sum(node.energy for node in self.nodesRef.values())
+
+    def num_dropped_msgs(self):
+        if self.store is not None:
+            return int(self.store.msgsDroppedCount[:self.store.size].sum())
+        return sum(node.msgsDroppedCount for node in self.nodesRef.values())
+
+    def collect_data(self):
+        # Statistics of the simulation (name -> value).
+        data = {
+            'time'           : self.clock.read(),
+            'atransmissions' : self.atransmissions,
+            'otransmissions' : self.otransmissions,
+            'droppedMsgs'    : self.num_dropped_msgs(),
+            'aliveNodes'     : self.num_alive_nodes(),
+            'remainingEnergy': self.total_energy(),
+            'sentMsgs'       : sum(node.sentMsgsCounter 
+                                   for node in self.nodesRef.values()
+                                   if not node.isSink),
+        }
+        # Sink metrics (sum of messages; worst and weighted average of hops 
+        # and time)
+        sinks = [node for node in self.nodesRef.values() if node.isSink]
+        recvd = sum(node.recvdMsgsCounter for node in sinks)
+        data['sinkRecvdMsgs'] = recvd
+        data['avgNumHops'] = 0
+        data['avgTimeSpent'] = 0
+        if recvd != 0:
+            data['avgNumHops'] = sum(node.avgNumHops * node.recvdMsgsCounter 
+                                     for node in sinks) / recvd
+            data['avgTimeSpent'] = sum(node.avgTimeSpent * 
+                                       node.recvdMsgsCounter
+                                       for node in sinks) / recvd
+        data['maxNumHops'] = max([node.maxNumHops for node in sinks] + [0])
+        data['maxTimeSpent'] = max([node.maxTimeSpent for node in sinks] + [0])
+        return data
+
     def print_data(self):
-        print('Time: ' + str(self.clock.read()))
-        print('Number of acoustic transmissions: ' + str(self.atransmissions))
-        print('Number of optical transmissions: ' + str(self.otransmissions))
+        data = self.collect_data()
+        print('Time: ' + str(data['time']))
+        print('Number of acoustic transmissions: ' + 
+              str(data['atransmissions']))
+        print('Number of optical transmissions: ' + 
+              str(data['otransmissions']))
+        print('Number of messages dropped (full outbox): ' + \
+              str(data['droppedMsgs']))
+        print('Number of alive nodes: ' + str(data['aliveNodes']))
+        print('Remaining energy: ' + str(data['remainingEnergy']))
+        if self.profiler is not None:
+            for line in self.profiler.report():
+                print(line)
+
+    def run_slot(self, node, advanceClock = True):
+        # Runs the time slot of the node: it transmits while there is time 
+        # left and the transmitted messages are delivered. When advanceClock
+        # is False the caller is responsible for running the clock (slot 
+        # shared by many nodes).
+        if self.verbose:
+            print('::Time slot of node ' + str(node.addr))
+        # If the node is out of energy, then just skip its time.
+        if node.energy <= 0:
+            if self.verbose:
+                print('Node ' + str(node.addr) + ' zZzz')
+            if advanceClock:
+                self.clock.run(self.timeInterval)
+            return
+        remainingTime = self.timeInterval
+        beginTimeSlot = True
+        while remainingTime > 0:
+            # message is transmitted by the node
+            timeSpent, msg = node.execute(remainingTime, beginTimeSlot)
+            # _, msg = node.execute(remainingTime, beginTimeSlot)
+            beginTimeSlot = False
+            if msg is None:
+                if self.verbose:
+                    print('No more messages')
+                if advanceClock:
+                    self.clock.run(remainingTime)
+                break
+            remainingTime -= timeSpent
+            if advanceClock:
+                self.clock.run(timeSpent)
+            # data in message header
+            isAcoustic = (msg.flags & UOARFlags.ACOUSTIC) != 0
+            needACK = (msg.flags & UOARFlags.WITH_ACK)
+            if msg.dst == BROADCAST_ADDR:
+                assert isAcoustic, 'Optical broadcasts are not allowed'
+                assert not needACK, 'Broadcasts can not require ACK'
+                self.deliver_broadcast(msg)
+                continue
+            # sending message
+            dst = msg.dst
+            if self.verbose:
+                print('Sending message to ' + str(dst))
+            # checking if the transmission was successful
+            per = self.link_per(msg.src, dst, isAcoustic, len(msg))
+            success = not (self.link_draw(msg.src, dst, isAcoustic) < per)
+            if isAcoustic:
+                self.atransmissions += 1
+            else:
+                self.otransmissions += 1
+            if self.traceMask & TraceEvent.SEND:
+                self.tracer.emit(TraceEvent.SEND, self.clock.read(), msg.src,
+                                 dst, msg.flags & 0x0f, len(msg), 
+                                 isAcoustic, success)
+            # If the transmission succed, then destination node receive 
+            # the message and may send an ack
+            if success:
+                # Getting ack and time spent sending it (if sent)
+                if self.verbose:
+                    print('Receiving message')
+                ackTime, ack = self.deliver(dst, msg)
+                # Removing time, if required.
+                if needACK:
+                    if isAcoustic:
+                        ackTime = self.nodesRef[dst].acousticAckTime
+                    else:
+                        ackTime = self.nodesRef[dst].opticalAckTime
+                    remainingTime -= ackTime
+                    if advanceClock:
+                        self.clock.run(ackTime)
+                # Sending ack.
+                if needACK and ack is not None:
+                    per = self.link_per(dst, ack.dst, isAcoustic, 
+                                        len(ack))
+                    success = not (self.link_draw(dst, ack.dst, isAcoustic)
+                                   < per)
+                    if isAcoustic:
+                        self.atransmissions += 1
+                    else: 
+                        self.otransmissions += 1
+                    if self.traceMask & TraceEvent.ACK:
+                        self.tracer.emit(TraceEvent.ACK, self.clock.read(),
+                                         dst, ack.dst, isAcoustic, success)
+                    if success:
+                        self.deliver(ack.dst, ack)
+                    else:
+                        if self.verbose:
+                            print('Failed to send ACK')
+                elif needACK:
+                    if self.verbose:
+                        print('Failed to ack')
+            else:
+                if self.verbose:
+                    print('Failed to send')
+        if self.traceMask & TraceEvent.STATE:
+            self.trace_state(node)
+        assert remainingTime >= 0, 'error: time interval was not ' + \
+                                   'respected by node ' + str(node.addr) + \
+                                   ' (' + str(remainingTime) + ')'
+
+    def run_events(self, nodesList, numSlots):
+        # Event driven version of the TDMA loop. The slots of the nodes that 
+        # can do something are kept in a heap of (slot, node index) and the 
+        # other slots are skipped at once: only the clock and the rounds of 
+        # the idle nodes advance. A node is checked again when it receives a
+        # message or when the application alarm goes off.
+        # Returns the index of the owner of the last slot.
+        numNodes = self.numNodes
+        firstNode = self.firstNode
+        dt = self.timeInterval
+        indexOf = dict((node.addr, i) for i, node in enumerate(nodesList))
+        events = []
+        scheduled = [False] * numNodes
+        idle = [False] * numNodes   # was idle (and alive) since accounted
+        accounted = [0] * numNodes  # first slot not counted in node round
+
+        def next_slot(i, slot):
+            # First slot >= slot that belongs to node i.
+            return slot + (i - firstNode - slot) % numNodes
+
+        def settle(i, slot):
+            # Adds the skipped slots of node i (before slot) to its rounds.
+            if idle[i]:
+                first = next_slot(i, accounted[i])
+                if first < slot:
+                    nodesList[i].round += (slot - 1 - first) // numNodes + 1
+            accounted[i] = slot
+
+        def refresh(i, slot):
+            # Checks if node i must run its next slot.
+            settle(i, slot)
+            node = nodesList[i]
+            idle[i] = node.energy > 0 and node.is_idle()
+            if node.energy > 0 and not idle[i] and not scheduled[i]:
+                nextSlot = next_slot(i, slot)
+                if nextSlot < numSlots:
+                    heappush(events, (nextSlot, i))
+                    scheduled[i] = True
+
+        slot = 0
+        for i in range(numNodes):
+            refresh(i, slot)
+        while True:
+            eventSlot = events[0][0] if len(events) != 0 else numSlots
+            # Nobody transmits until eventSlot: skips the slots before it, 
+            # or before the one where an alarm goes off
+            slot += self.clock.skip(eventSlot - slot, dt)
+            if slot >= numSlots:
+                break
+            numCalls = self.clock.numCalls
+            if slot < eventSlot:
+                # Idle slot where the alarm goes off
+                self.clock.run(dt)
+                slot += 1
+                touched = range(numNodes)
+            else:
+                _, i = heappop(events)
+                scheduled[i] = False
+                settle(i, eventSlot)
+                self.touched = set()
+                self.run_slot(nodesList[i])
+                touched = [i] + [indexOf[addr] for addr in self.touched]
+                self.touched = None
+                slot = eventSlot + 1
+            if self.clock.numCalls != numCalls:
+                # Some alarm went off (e.g. new application messages)
+                touched = range(numNodes)
+            for i in touched:
+                refresh(i, slot)
+        for i in range(numNodes):
+            settle(i, numSlots)
+        return (firstNode + numSlots - 1) % numNodes
+
+    def run_tdma(self, nodesList, numSlots):
+        # Fixed TDMA loop. After a whole round without transmissions and 
+        # alarms, it checks if the network is quiescent and, if so, jumps to
+        # the slots just before the next alarm (see skip_slots).
+        # Returns the index of the owner of the last slot.
+        slot = 0
+        quietSlots = 0 # consecutive slots without transmissions or alarms
+        while slot < numSlots:
+            if self.fastForward and quietSlots >= self.numNodes:
+                numSkipped = 0
+                if self.is_quiescent(nodesList):
+                    numSkipped = self.skip_slots(nodesList, slot, 
+                                                 numSlots - slot)
+                if numSkipped > 0:
+                    slot += numSkipped
+                    continue
+                quietSlots = 0 # checks again after another round
+            # Choosing the node that will trasmit in this time slot 
+            # (in ascending order)
+            currNode = (self.firstNode + slot) % self.numNodes
+            node = nodesList[currNode]
+            numTransmissions = self.atransmissions + self.otransmissions
+            numCalls = self.clock.numCalls
+            self.run_slot(node)
+            if numTransmissions == self.atransmissions + self.otransmissions \
+               and numCalls == self.clock.numCalls:
+                quietSlots += 1
+            else:
+                quietSlots = 0
+            slot += 1
+        return (self.firstNode + numSlots - 1) % self.numNodes
+
+    def is_quiescent(self, nodesList):
+        # True if no alive node may transmit until the next alarm.
+        for node in nodesList:
+            if node.energy > 0 and not node.is_idle():
+                return False
+        return True
+
+    def skip_slots(self, nodesList, slot, maxSlots):
+        # Jumps over the idle slots (up to maxSlots) before the one where the
+        # next alarm goes off, starting at slot (relative to firstNode): only
+        # the clock and the rounds of the alive nodes change (as in an idle 
+        # time slot). The slot of the alarm is run by the loop, as without
+        # the jump. Returns the number of slots skipped.
+        numSlots = self.clock.skip(maxSlots, self.timeInterval)
+        numNodes = self.numNodes
+        numRounds, rest = divmod(numSlots, numNodes)
+        first = (self.firstNode + slot) % numNodes
+        for i, node in enumerate(nodesList):
+            if node.energy > 0:
+                node.round += numRounds
+                if (i - first) % numNodes < rest:
+                    node.round += 1
+        return numSlots
+
+    def run_groups(self, nodesList, numSlots):
+        # TDMA loop with spatial reuse: all nodes of a group (same color) 
+        # transmit in the same slot. Returns the index of the last group.
+        numGroups = len(self.slotGroups)
+        for slot in range(0, numSlots):
+            currGroup = (self.firstGroup + slot) % numGroups
+            for i in self.slotGroups[currGroup]:
+                self.run_slot(nodesList[i], False)
+            self.clock.run(self.timeInterval)
+        return currGroup
 
     def start(self, stopExec):
         assert (stopExec > 0), 'Execution time must be > 0' 
+        self.prepare()
+        self.pendingSlots = int(stopExec/self.timeInterval)
+        print('Simulation started')
+        self.run_pending()
+        print('Simulation finished')
+        if self.tracer is not None:
+            self.tracer.flush()
+        self.print_data()
+
+    def prepare(self):
+        # Applies the parameters of the simulation (done by start).
         assert (self.packetSize > 0), 'Packet size can not be <= 0'
         assert (len(self.nodesRef) is not 0), 'Missing nodes' 
         assert (self.appStart is not INFINITY), 'Missing app start time'
         assert (self.appInterval is not INFINITY), 'Missing app interval time'
         assert (self.appStop > self.appStart), 'Stop time must be > start time'
 
+        if self.rng is None:
+            self.rng = np.random.default_rng(getrandbits(64))
         if not self.clock.alarm_is_on():
             self.clock.set_alarm(self.create_app_msgs, self.appStart, \
                                  self.appInterval, self.appStop)
+        else:
+            # The application may have changed (e.g. in a variant forked from
+            # a checkpoint). It takes effect after the next call.
+            self.clock.mainAlarm.interval = self.appInterval
+            self.clock.mainAlarm.lastCall = self.appStop
         
         if self.timeInterval is None:
             # If any time interval is informed, then it calculates the minimum
@@ -115,111 +652,130 @@ class Simulator:
             self.update_nodes_info()
         # Creating a basic payload to avoid large memory usage
         payloadSize = self.packetSize - (2 * Message.headerSize)
-        basicPayload = list(x for x in range(0, payloadSize))
+        if self.virtualPayload:
+            basicPayload = VirtualPayload(payloadSize)
+        else:
+            basicPayload = list(x for x in range(0, payloadSize))
         for node in self.nodesRef.values():
             node.timeInterval = self.timeInterval
             node.cbrInterval  = self.appInterval
             node.basicPayload = basicPayload
-        nodesList = list(self.nodesRef.values())
-        numSlots = int(stopExec/self.timeInterval)
-        print('Simulation started')
-        for slot in range(0, numSlots):
-            # Choosing the node that will trasmit in this time slot 
-            # (in ascending order)
-            currNode = (self.firstNode + slot) % self.numNodes
-            node = nodesList[currNode]
+            node.outbox.set_capacity(self.outboxMaxMsgs, self.outboxMaxBytes,
+                                     self.dropPolicy)
+        if self.profiler is not None:
+            self.profiler.attach(self)
+
+    def converged(self):
+        # True if the clusters and routes are ready: all alive nodes are 
+        # READY and no control message is waiting to be sent.
+        for node in self.nodesRef.values():
+            if node.energy > 0 and (node.status is not UOARStatus.READY or 
+                                    len(node.outbox.control) != 0):
+                return False
+        return True
+
+    def set_slot_groups(self, nodesList):
+        # Colors the nodes for spatial reuse, if not done yet (same groups 
+        # after a checkpoint, as nodes keep their order).
+        if self.slotGroups is None:
+            self.slotGroups = self.color_nodes(nodesList)
             if self.verbose:
-                print('::Time slot of node ' + str(node.addr))
-            # If the node is out of energy, then just skip its time.
-            if node.energy <= 0:
-                if self.verbose:
-                    print('Node ' + str(node.addr) + ' zZzz')
-                self.clock.run(self.timeInterval)
-                continue
-            remainingTime = self.timeInterval
-            beginTimeSlot = True
-            while remainingTime > 0:
-                # message is transmitted by the node
-                timeSpent, msg = node.execute(remainingTime, beginTimeSlot)
-                # _, msg = node.execute(remainingTime, beginTimeSlot)
-                beginTimeSlot = False
-                if msg is None:
-                    if self.verbose:
-                        print('No more messages')
-                    self.clock.run(remainingTime)
-                    break
-                remainingTime -= timeSpent
-                self.clock.run(timeSpent)
-                # data in message header
-                isAcoustic = (msg.flags & UOARFlags.ACOUSTIC)
-                needACK = (msg.flags & UOARFlags.WITH_ACK)
-                if msg.dst == BROADCAST_ADDR:
-                    assert isAcoustic, 'Optical broadcasts are not allowed'
-                    destinations = self.aneighbors[msg.src]
-                    self.atransmissions += 1
-                else:
-                    destinations = [msg.dst]
-                # sending messages
-                for dst in destinations:
-                    if self.verbose:
-                        print('Sending message to ' + str(dst))
-                    srcPos = self.nodesRef[msg.src].position
-                    dstPos = self.nodesRef[dst].position
-                    dist = Tools.distance(srcPos, dstPos)
-                    # checking if the transmission was successful
-                    if isAcoustic:
-                        success = self.achannel.use(AM.frequency, \
-                                                    AM.txPower, \
-                                                    dist, \
-                                                    len(msg))
-                        self.atransmissions += 1
-                    else:
-                        success = self.ochannel.use(OM.txPower, dist, \
-                                                    dist, self.beta, \
-                                                    len(msg))
-                        self.otransmissions += 1
-                    # If the transmission succed, then destination node receive 
-                    # the message and may send an ack
-                    if success:
-                        # Getting ack and time spent sending it (if sent)
-                        if self.verbose:
-                            print('Receiving message')
-                        ackTime, ack = self.nodesRef[dst].recv_msg(msg)
-                        # Removing time, if required.
-                        if needACK:
-                            if isAcoustic:
-                                ackTime = self.nodesRef[dst].acousticAckTime
-                            else:
-                                ackTime = self.nodesRef[dst].opticalAckTime
-                            remainingTime -= ackTime
-                            self.clock.run(ackTime)
-                        # Sending ack.
-                        if needACK and ack is not None:
-                            if isAcoustic:
-                                success = self.achannel.use(AM.frequency, \
-                                                            AM.txPower, \
-                                                            dist, \
-                                                            len(ack))
-                                self.atransmissions += 1
-                            else: 
-                                success = self.ochannel.use(OM.txPower, dist, \
-                                                            dist, self.beta, \
-                                                            len(ack))
-                                self.otransmissions += 1
-                            if success:
-                                self.nodesRef[ack.dst].recv_msg(ack)
-                            else:
-                                if self.verbose:
-                                    print('Failed to send ACK')
-                        elif needACK:
-                            if self.verbose:
-                                print('Failed to ack')
-                    else:
-                        if self.verbose:
-                            print('Failed to send')
-            assert remainingTime >= 0, 'error: time interval was not ' + \
-                                       'respected by node ' + str(node.addr) + \
-                                       ' (' + str(remainingTime) + ')'
-        self.firstNode = currNode + 1 # saving for possible future executions
+                print('Number of slot groups: ' + str(len(self.slotGroups)))
+
+    def round_slots(self):
+        # Number of slots of a round (every node has its slot once): one per
+        # node, or one per group in spatial reuse.
+        if self.spatialReuse:
+            self.set_slot_groups(list(self.nodesRef.values()))
+            return len(self.slotGroups)
+        return len(self.nodesRef)
+
+    def run_pending(self):
+        # Runs the pending slots, in parts of checkpointInterval slots when
+        # checkpoints are on (a checkpoint is saved after each part).
+        nodesList = list(self.nodesRef.values())
+        if self.spatialReuse:
+            assert not self.eventDriven, 'Spatial reuse is not event driven'
+            self.set_slot_groups(nodesList)
+        while self.pendingSlots > 0:
+            numSlots = self.pendingSlots
+            if self.checkpointFile is not None and \
+               self.checkpointInterval is not None:
+                numSlots = min(numSlots, self.checkpointInterval)
+            if self.spatialReuse:
+                currGroup = self.run_groups(nodesList, numSlots)
+                self.firstGroup = currGroup + 1
+            elif self.eventDriven:
+                currNode = self.run_events(nodesList, numSlots)
+                self.firstNode = currNode + 1
+            else:
+                currNode = self.run_tdma(nodesList, numSlots)
+                self.firstNode = currNode + 1 # saving for future executions
+            self.pendingSlots -= numSlots
+            self.slotsRun += numSlots
+            if self.checkpointFile is not None:
+                self.save_checkpoint(self.checkpointFile)
+
+    def resume(self):
+        # Finishes the start that was running when the checkpoint was saved
+        # (for a simulator returned by load_checkpoint).
+        print('Simulation resumed')
+        self.run_pending()
         print('Simulation finished')
+        if self.tracer is not None:
+            self.tracer.flush()
         self.print_data()
+
+    def save_checkpoint(self, fileName, compress = True):
+        # Saves the whole state of the simulation (nodes, outboxes, clock and 
+        # alarms, counters and random generators) in fileName, compressed 
+        # with gzip unless compress is False (level 1: most of the gain of
+        # higher levels, at a small part of the time of saving). The tracer,
+        # the profiler and the caches rebuilt on demand (link PERs and slot
+        # groups) are not saved. The file is replaced at once, so a crash 
+        # while saving keeps the last checkpoint.
+        tracer = self.tracer
+        profiler = self.profiler
+        linkCache = self.linkCache
+        slotGroups = self.slotGroups
+        self.linkCache = {}
+        self.slotGroups = None
+        if tracer is not None:
+            tracer.flush()
+            self.set_tracer(None)
+        if profiler is not None:
+            profiler.detach()
+            self.profiler = None
+        try:
+            state = {'simulator': self, 'random': getstate(), 
+                     'sinkNodesAddr': Node.sinkNodesAddr}
+            tmpName = fileName + '.' + str(os.getpid()) + '.tmp'
+            if compress:
+                f = gzip.open(tmpName, 'wb', compresslevel=1)
+            else:
+                f = open(tmpName, 'wb')
+            with f:
+                CheckpointPickler(f, pickle.HIGHEST_PROTOCOL).dump(state)
+            os.replace(tmpName, fileName)
+        finally:
+            self.linkCache = linkCache
+            self.slotGroups = slotGroups
+            if tracer is not None:
+                self.set_tracer(tracer)
+            if profiler is not None:
+                self.profiler = profiler
+                profiler.attach(self)
+
+    def load_checkpoint(fileName):
+        # Returns the simulator saved in fileName. The random module state is
+        # restored too. Call resume() to finish the interrupted start, or set
+        # new parameters and call start() (e.g. to fork variants). Files
+        # saved with or without compression are both accepted.
+        with open(fileName, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b' # gzip magic number
+        opener = gzip.open if compressed else open
+        with opener(fileName, 'rb') as f:
+            state = CheckpointUnpickler(f).load()
+        setstate(state['random'])
+        Node.sinkNodesAddr = state['sinkNodesAddr']
+        return state['simulator']
@@ -0,0 +1,158 @@
+###############################################################################
+##  Laboratorio de Engenharia de Computadores (LECOM),                       ##
+##  Universidade Federal de Minas Gerais (UFMG).                             ##
+##                                                                           ##
+##  Parameter sweeps: runs one simulation for each point of a parameter     ##
+##  grid (and each seed) in a process pool. Usage example:                   ##
+##      python sweep.py --seeds 0-29 --param numNodes=4,8,16 \               ##
+##                      --param appInterval=60,600 --output results.csv      ##
+##                                                                           ##
+##  Author: Eduardo Pinto                                                    ##
+###############################################################################
+
+import argparse
+import contextlib
+import csv
+import itertools
+import os
+import sys
+from ast import literal_eval
+from concurrent.futures import ProcessPoolExecutor
+
+from clustercache import ClusterCache
+from simulator import Simulator
+from tools import Tools
+
+# Parameters of a run (and their default values)
+DEFAULTS = {
+    'seed'        : 0,
+    'xmax'        : 2000,
+    'ymax'        : 2000,
+    'depthmax'    : 500,
+    'numClusters' : 4,
+    'numNodes'    : 8,     # nodes per cluster
+    'numSinks'    : 1,
+    'energy'      : 1000,  # initial energy of each node, in J
+    'packetSize'  : 100,   # in bytes
+    'appStart'    : 1000,
+    'appInterval' : 60,
+    'appStop'     : float('inf'),
+    'stopExec'    : 5000,  # simulated time, in s
+    'eventDriven' : False,
+    'spatialReuse': False,
+}
+
+def run_point(params, cacheDir = None):
+    # Runs one simulation. params has the keys of DEFAULTS (missing ones get
+    # the default value). Returns params plus Simulator.collect_data(). If
+    # cacheDir is given, converged networks are taken from (and saved to)
+    # a ClusterCache there.
+    point = dict(DEFAULTS)
+    point.update(params)
+    # Each run has its own seed: the topology and the channel of every link
+    # come from independent streams of it
+    sim = Simulator()
+    sim.seed         = point['seed']
+    sim.packetSize   = point['packetSize']
+    sim.appStart     = point['appStart']
+    sim.appInterval  = point['appInterval']
+    sim.appStop      = point['appStop']
+    sim.eventDriven  = point['eventDriven']
+    sim.spatialReuse = point['spatialReuse']
+    positions = Tools.distribute_nodes(point['xmax'], point['ymax'],
+                                       point['depthmax'], point['numClusters'],
+                                       point['numNodes'], point['numSinks'],
+                                       sim.topology_rng())
+    for addr, pos in enumerate(positions, 1):
+        sim.create_node(addr, pos[0], pos[1], pos[2], point['energy'])
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            if cacheDir is None:
+                sim.start(point['stopExec'])
+            else:
+                sim = ClusterCache(cacheDir).start(sim, point['stopExec'])
+    result = dict(point)
+    result.update(sim.collect_data())
+    return result
+
+def make_grid(grid, seeds):
+    # List of runs (dicts) for all combinations of the grid values (name ->
+    # list of values) and seeds.
+    names = sorted(grid.keys())
+    for name in names:
+        assert name in DEFAULTS and name != 'seed', 'Unknown param: ' + name
+    points = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        for seed in seeds:
+            point = dict(zip(names, values))
+            point['seed'] = seed
+            points.append(point)
+    return points
+
+def sweep(grid, seeds, workers = None, chunksize = 1, cacheDir = None):
+    # Runs all points of the grid in a process pool. Returns the results
+    # table (list of dicts), in the order of make_grid. Results do not depend
+    # on the number of workers. For many short runs, a larger chunksize
+    # reduces the cost of sending work to the processes.
+    points = make_grid(grid, seeds)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_point, points, 
+                                 [cacheDir] * len(points), 
+                                 chunksize=chunksize))
+
+def write_results(results, output):
+    # Writes the results table as CSV (output is a file name or a file).
+    if len(results) == 0:
+        return
+    fields = list(results[0].keys())
+    if isinstance(output, str):
+        with open(output, 'w', newline='') as f:
+            write_results(results, f)
+        return
+    writer = csv.DictWriter(output, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(results)
+
+def parse_seeds(text):
+    # '5' -> [5], '0-3' -> [0, 1, 2, 3], '1,4,7' -> [1, 4, 7]
+    seeds = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            seeds.extend(range(int(first), int(last) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+def parse_value(text):
+    # Python literal, or a float such as 'inf' (e.g. appStop=inf)
+    try:
+        return literal_eval(text)
+    except (ValueError, SyntaxError):
+        return float(text)
+
+def parse_param(text):
+    # 'name=v1,v2' -> ('name', [v1, v2]) (values as in parse_value)
+    name, values = text.split('=', 1)
+    return name, [parse_value(value) for value in values.split(',')]
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Simulator parameter sweep')
+    parser.add_argument('--seeds', default='0',
+                        help='seeds, e.g. 0-99 or 1,2,3')
+    parser.add_argument('--param', action='append', default=[],
+                        help='name=v1,v2,... (one per parameter)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=1)
+    parser.add_argument('--cache', default=None,
+                        help='directory of the warm start cache')
+    parser.add_argument('--output', default=None,
+                        help='CSV file (default: standard output)')
+    args = parser.parse_args(argv)
+    grid = dict(parse_param(text) for text in args.param)
+    results = sweep(grid, parse_seeds(args.seeds), args.workers,
+                    args.chunksize, args.cache)
+    write_results(results, args.output or sys.stdout)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -7,11 +7,10 @@
 ##  Author: Eduardo Pinto                                                    ##
 ###############################################################################
 
-import operator
 import random
+from heapq import heappush, heappop
 from math import floor, sqrt
 
-import matplotlib.pyplot as plt
 import numpy as np
 
 from messages import UOARFlags
@@ -20,43 +19,100 @@ from modens import OpticalModem as OM
 
 INFINITY = float('inf')
 
+# Kinds of random streams of a seeded simulation (see Tools.stream_seed)
+class RNGStream:
+    TOPOLOGY  = 0 # node positions
+    LINK      = 1 # success of unicast transmissions (one stream per link)
+    BROADCAST = 2 # success of broadcasts (one stream per source)
+
 class Tools:
     def distance(a, b):
-        c = list(map(operator.sub, a, b))
-        c = map(lambda x: x ** 2, c)
-        return sqrt(sum(c))
+        dx = a[0] - b[0]
+        dy = a[1] - b[1]
+        dd = a[2] - b[2]
+        return sqrt(dx * dx + dy * dy + dd * dd)
+
+    def distances(points, others = None):
+        # Batched distances (NumPy). points is an (N,3) array. Returns the
+        # (N,N) matrix of pairwise distances if others is None, the (N,) 
+        # distances to others if it is a single point, or the (N,M) matrix
+        # if it is an (M,3) array.
+        points = np.asarray(points, dtype=float)
+        if others is None:
+            others = points
+        others = np.asarray(others, dtype=float)
+        if others.ndim == 1:
+            diff = points - others
+        else:
+            diff = points[:, np.newaxis, :] - others[np.newaxis, :, :]
+        return np.sqrt(np.einsum('...k,...k->...', diff, diff))
+
+    def stream_seed(seed, kind, *key):
+        # Seed of an independent random stream. The stream only depends on
+        # the seed, the kind (RNGStream) and the key (e.g. addrs of a link),
+        # not on the order in which streams are created or used.
+        return np.random.SeedSequence([seed, kind] + [int(k) for k in key])
+
+    # Counter-based streams (splitmix64): the state is a 64-bit int and each
+    # draw adds GAMMA to it and hashes it, so a stream takes a few bytes
+    # (in memory and in checkpoints) however many draws it gives.
+    GAMMA = 0x9e3779b97f4a7c15
+    MASK  = 0xffffffffffffffff
+
+    def stream_state(seed, kind, *key):
+        # Initial state of the counter-based stream of stream_seed.
+        seedSeq = Tools.stream_seed(seed, kind, *key)
+        return int(seedSeq.generate_state(1, np.uint64)[0])
+
+    def uniform(state):
+        # Next state and uniform number in [0, 1) of a counter-based stream.
+        state = (state + Tools.GAMMA) & Tools.MASK
+        z = ((state ^ (state >> 30)) * 0xbf58476d1ce4e5b9) & Tools.MASK
+        z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & Tools.MASK
+        return state, ((z ^ (z >> 31)) >> 11) * (1.0 / 9007199254740992)
 
-    def distribute_nodes(xmax, ymax, depthmax, numClusters, numNodes, numSinks):
+    def uniforms(state, size):
+        # Same as size calls of uniform (next state and array of numbers).
+        # NumPy uint64 arithmetic wraps around, as the masks in uniform.
+        z = (np.uint64(state) + np.uint64(Tools.GAMMA) *
+             np.arange(1, size + 1, dtype=np.uint64))
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        z = (z ^ (z >> np.uint64(31))) >> np.uint64(11)
+        state = (state + size * Tools.GAMMA) & Tools.MASK
+        return state, z * (1.0 / 9007199254740992)
+
+    def distribute_nodes(xmax, ymax, depthmax, numClusters, numNodes, numSinks,
+                         rng = None):
+        # List version of distribute_nodes_array.
+        return Tools.distribute_nodes_array(xmax, ymax, depthmax, numClusters,
+                                            numNodes, numSinks, rng).tolist()
+
+    def distribute_nodes_array(xmax, ymax, depthmax, numClusters, numNodes, 
+                               numSinks, rng = None):
+        # Returns an (N,3) array with the positions of numSinks sinks (at the
+        # surface, in the first sector) followed by numClusters clusters of
+        # numNodes nodes, each one in a different random sector. The space is
+        # divided in numClusters ** 3 sectors. rng is a NumPy generator (by 
+        # default, seeded from the random module).
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
         xsize = xmax / numClusters
         ysize = ymax / numClusters
         dsize = depthmax / numClusters
-        allSectors = list(range(0, numClusters ** 3))
-        
-        nodes = []
-        for i in range(0, numSinks):
-            nx = random.random() * xsize
-            ny = random.random() * ysize
-            nodes.append([nx, ny, 0])
-
-        for i in range(0, numClusters):
-            index = random.randint(0, len(allSectors)-1)
-            currSector = allSectors.pop(index)
-            d = floor(currSector / (numClusters**2))
-            yx = currSector % (numClusters**2)
-            y = floor(yx / numClusters)
-            x = yx % numClusters
-            
-            x *= xsize
-            y *= ysize
-            d *= dsize
-
-            for j in range(0, numNodes):
-                nx = x + random.random() * xsize
-                ny = y + random.random() * ysize
-                nd = d + random.random() * dsize
-                nodes.append([nx, ny, nd])
-
-        return nodes
+        sinks = np.zeros((numSinks, 3))
+        sinks[:, :2] = rng.random((numSinks, 2)) * [xsize, ysize]
+
+        sectors = rng.choice(numClusters ** 3, numClusters, replace=False)
+        d = sectors // (numClusters ** 2)
+        yx = sectors % (numClusters ** 2)
+        y = yx // numClusters
+        x = yx % numClusters
+        origins = np.stack([x * xsize, y * ysize, d * dsize], axis=1)
+        origins = np.repeat(origins, numNodes, axis=0)
+        nodes = origins + rng.random((numClusters * numNodes, 3)) * \
+                [xsize, ysize, dsize]
+        return np.concatenate([sinks, nodes])
 
     def estimate_transmission(msg):
         if (msg.flags & UOARFlags.ACOUSTIC):
@@ -67,34 +123,163 @@ class Tools:
             energy = time * OM.txPowerConsumption
         return time, energy
 
+class SpatialIndex:
+    # Uniform grid used to answer range queries without comparing every pair
+    # of nodes. Cells have the size of the query radius, so only the 27 cells
+    # around a point must be checked.
+    def __init__(self, cellSize):
+        assert cellSize > 0, 'Cell size must be > 0'
+        self.cellSize = cellSize
+        self.cells = {}
+        self.items = {} # key -> [position, insertion order, cell]
+        self.counter = 0
+
+    def cell_of(self, position):
+        return (floor(position[0] / self.cellSize),
+                floor(position[1] / self.cellSize),
+                floor(position[2] / self.cellSize))
+
+    def insert(self, key, position):
+        if key in self.items:
+            self.remove(key)
+        cell = self.cell_of(position)
+        self.items[key] = [position, self.counter, cell]
+        self.counter += 1
+        if cell not in self.cells:
+            self.cells[cell] = []
+        self.cells[cell].append(key)
+
+    def remove(self, key):
+        _, _, cell = self.items.pop(key)
+        self.cells[cell].remove(key)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def query(self, position, radius, exclude = None):
+        # Returns the keys within radius of position, in insertion order.
+        assert radius <= self.cellSize, 'Radius must be <= cell size'
+        px, py, pd = position
+        cx, cy, cd = self.cell_of(position)
+        found = []
+        for i in (cx - 1, cx, cx + 1):
+            for j in (cy - 1, cy, cy + 1):
+                for k in (cd - 1, cd, cd + 1):
+                    cell = self.cells.get((i, j, k))
+                    if cell is None:
+                        continue
+                    for key in cell:
+                        if key == exclude:
+                            continue
+                        item = self.items[key]
+                        # Same arithmetic as Tools.distance, inlined.
+                        dx = px - item[0][0]
+                        dy = py - item[0][1]
+                        dd = pd - item[0][2]
+                        if sqrt(dx * dx + dy * dy + dd * dd) <= radius:
+                            found.append((item[1], key))
+        found.sort()
+        return [key for _, key in found]
+
+class Alarm:
+    # Handle of an alarm registered in a Clock. It can be cancelled or 
+    # rescheduled.
+    def __init__(self, clock, call, start, interval, stop):
+        self.clock    = clock
+        self.routine  = call
+        self.nextCall = start
+        self.interval = interval # None for alarms that go off only once
+        self.lastCall = stop
+        self.entry    = None     # current entry in the clock heap
+
+    def is_on(self):
+        return self.entry is not None
+
+    def cancel(self):
+        # Entries of cancelled alarms are just ignored when they reach the top
+        # of the heap.
+        self.entry = None
+
+    def reschedule(self, start):
+        self.clock.schedule(self, start)
+
 class Clock:
     def __init__(self):
         self.__currTime = 0
-        self.nextCall = INFINITY
-        self.lastCall = INFINITY
-        self.interval = 0
-        self.routine = None
+        self.__alarms = [] # heap of [time, sequence number, alarm]
+        self.__counter = 0 # tie breaker (alarms at the same time go off in
+                           # the order they were scheduled)
+        self.numCalls = 0  # number of alarms that went off
+        self.mainAlarm = None
 
     def run(self, time):
         self.__currTime = self.__currTime + time
-        if self.__currTime >= self.nextCall:
-            self.routine()
-            if self.nextCall >= self.lastCall:
-                self.nextCall = INFINITY
-            else:
-                self.nextCall = self.nextCall + self.interval
+        alarms = self.__alarms
+        while len(alarms) != 0 and alarms[0][0] <= self.__currTime:
+            entry = heappop(alarms)
+            alarm = entry[2]
+            if alarm.entry is not entry:
+                continue # cancelled or rescheduled
+            alarm.entry = None
+            self.numCalls += 1
+            if alarm.interval is not None and alarm.nextCall < alarm.lastCall:
+                self.schedule(alarm, alarm.nextCall + alarm.interval)
+            alarm.routine()
     
     def read(self):
         return self.__currTime
 
-    def set_alarm(self, call, start, interval, stop = INFINITY):
-        self.nextCall = start
-        while self.nextCall <= self.__currTime:
-            self.nextCall = self.nextCall + self.interval
+    def skip(self, numSlots, interval):
+        # Runs up to numSlots slots of interval where nothing happens, 
+        # stopping before the slot where the next alarm goes off. The time is
+        # added once per slot, as run does in a TDMA loop, so the clock 
+        # (and when alarms go off) does not depend on the skip. Returns the
+        # number of slots run (alarms are not called).
+        nextCall = self.next_call()
+        currTime = self.__currTime
+        for slot in range(numSlots):
+            nextTime = currTime + interval
+            if nextCall <= nextTime:
+                self.__currTime = currTime
+                return slot
+            currTime = nextTime
+        self.__currTime = currTime
+        return numSlots
 
-        self.interval = interval
-        self.lastCall = stop
-        self.routine = call
+    def add_alarm(self, call, start, interval = None, stop = INFINITY):
+        # Registers a new alarm that calls call at start and then at each 
+        # interval (if any) until stop. Returns its handle.
+        assert interval is None or interval > 0, 'Interval must be > 0'
+        if interval is not None:
+            while start <= self.__currTime:
+                start = start + interval
+        alarm = Alarm(self, call, start, interval, stop)
+        self.schedule(alarm, start)
+        return alarm
+
+    def schedule(self, alarm, time):
+        # (Re)schedules the alarm to go off at time.
+        alarm.nextCall = time
+        if time is INFINITY:
+            alarm.entry = None
+            return
+        alarm.entry = [time, self.__counter, alarm]
+        self.__counter += 1
+        heappush(self.__alarms, alarm.entry)
+
+    def next_call(self):
+        # Time of the next alarm (INFINITY if there is none).
+        alarms = self.__alarms
+        while len(alarms) != 0 and alarms[0][2].entry is not alarms[0]:
+            heappop(alarms)
+        if len(alarms) == 0:
+            return INFINITY
+        return alarms[0][0]
+
+    def set_alarm(self, call, start, interval, stop = INFINITY):
+        # Main alarm (replaces the previous one).
+        if self.mainAlarm is not None:
+            self.mainAlarm.cancel()
+        self.mainAlarm = self.add_alarm(call, start, interval, stop)
 
     def alarm_is_on(self):
-        return self.nextCall is not INFINITY
+        return self.mainAlarm is not None and self.mainAlarm.is_on()
@@ -0,0 +1,87 @@
+###############################################################################
+##  Laboratorio de Engenharia de Computadores (LECOM),                       ##
+##  Universidade Federal de Minas Gerais (UFMG).                             ##
+##                                                                           ##
+##  Structured trace of the simulation: one JSON object per line, e.g.       ##
+##  {"t":1000.12,"ev":"send","node":3,"dst":2,"type":0,"size":104,...}       ##
+##                                                                           ##
+##  Author: Eduardo Pinto                                                    ##
+###############################################################################
+
+import json
+
+# Types of events (bit mask, so they can be filtered)
+class TraceEvent:
+    SEND   = 0x01 # transmission (recvd: number of nodes that got it)
+    RECV   = 0x02 # message received (and handled) by the node
+    ACK    = 0x04 # transmission of an ACK (recvd: 1 if it got to dst)
+    DROP   = 0x08 # message discarded by the node (dst is -1 if unknown)
+    STATE  = 0x10 # change of state and/or status
+    ENERGY = 0x20 # energy went below a threshold (fraction of the maximum)
+    NONE   = 0x00
+    ALL    = 0x3f
+    # name and fields (name, format) of each type, besides time and node
+    formats = {
+        SEND   : ('send', [('dst', '%d'), ('type', '%d'), ('size', '%d'),
+                           ('acoustic', '%d'), ('recvd', '%d')]),
+        RECV   : ('recv', [('src', '%d'), ('type', '%d')]),
+        ACK    : ('ack', [('dst', '%d'), ('acoustic', '%d'), ('recvd', '%d')]),
+        DROP   : ('drop', [('reason', '"%s"'), ('dst', '%d'), ('type', '%d')]),
+        STATE  : ('state', [('state', '%d'), ('status', '%d')]),
+        ENERGY : ('energy', [('energy', '%r'), ('threshold', '%r')]),
+    }
+
+class Tracer:
+    # Writes the events selected by the mask to output (file name or text
+    # file). Lines are kept in a buffer and written bufferSize at a time.
+    # Callers check the mask before building an event, so disabled events
+    # cost one test.
+    def __init__(self, output, mask = TraceEvent.ALL, bufferSize = 4096):
+        assert bufferSize > 0, 'Buffer size must be > 0'
+        self.mask = mask
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.numEvents = 0
+        self.ownsFile = isinstance(output, str)
+        if self.ownsFile:
+            self.file = open(output, 'w')
+        else:
+            self.file = output
+        # A line template for each type (faster than a JSON encoder)
+        self.templates = {}
+        for event, (name, fields) in TraceEvent.formats.items():
+            template = '{"t":%r,"ev":"' + name + '","node":%d'
+            for field, fmt in fields:
+                template += ',"' + field + '":' + fmt
+            self.templates[event] = template + '}'
+
+    def emit(self, event, time, addr, *values):
+        # Adds the event of node addr at time (values of the fields of the
+        # type, in the order of TraceEvent.formats).
+        if not (self.mask & event):
+            return
+        self.buffer.append(self.templates[event] % ((time, addr) + values))
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) != 0:
+            self.numEvents += len(self.buffer)
+            self.file.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.ownsFile:
+            self.file.close()
+
+def read_trace(fileName, mask = TraceEvent.ALL):
+    # Generator of the events (dicts) of a trace file, filtered by the mask.
+    names = set(name for event, (name, _) in TraceEvent.formats.items()
+                if mask & event)
+    with open(fileName) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['ev'] in names:
+                yield record
@@ -0,0 +1,66 @@
+###############################################################################
+##  Laboratorio de Engenharia de Computadores (LECOM),                       ##
+##  Universidade Federal de Minas Gerais (UFMG).                             ##
+##                                                                           ##
+##  Plotting (optional, requires matplotlib). Not imported by the simulator ##
+##  so that runs do not pay for loading matplotlib.                          ##
+##                                                                           ##
+##  Author: Eduardo Pinto                                                    ##
+###############################################################################
+
+import matplotlib.pyplot as plt
+
+from node import UOARState
+
+# Color and label of the nodes of each kind
+STYLES = {
+    'sink'   : ('red', 'Sink'),
+    'head'   : ('blue', 'Cluster head'),
+    'member' : ('green', 'Cluster member'),
+    'other'  : ('gray', 'Other'),
+    'dead'   : ('black', 'Dead'),
+}
+
+def node_kind(node):
+    if node.energy <= 0:
+        return 'dead'
+    if node.isSink:
+        return 'sink'
+    if node.state is UOARState.CLUSTER_HEAD:
+        return 'head'
+    if node.state is UOARState.CLUSTER_MEMBER:
+        return 'member'
+    return 'other'
+
+def plot_network(sim, fileName = None, routes = True):
+    # Plots the nodes of the simulator (3D, depth grows downwards) and, if
+    # routes is True, a line from each node to its next hop. The figure is
+    # saved in fileName or shown if it is None. Returns the figure.
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection='3d')
+    groups = {}
+    for node in sim.nodesRef.values():
+        groups.setdefault(node_kind(node), []).append(node.position)
+    for kind, positions in groups.items():
+        color, label = STYLES[kind]
+        ax.scatter([p[0] for p in positions], [p[1] for p in positions],
+                   [p[2] for p in positions], c=color, label=label, s=12)
+    if routes:
+        for node in sim.nodesRef.values():
+            if node.nextHop is None or node.nextHop not in sim.nodesRef:
+                continue
+            nextPos = sim.nodesRef[node.nextHop].position
+            ax.plot([node.position[0], nextPos[0]],
+                    [node.position[1], nextPos[1]],
+                    [node.position[2], nextPos[2]],
+                    c=STYLES[node_kind(node)][0], linewidth=0.5)
+    ax.set_xlabel('x (m)')
+    ax.set_ylabel('y (m)')
+    ax.set_zlabel('depth (m)')
+    ax.invert_zaxis()
+    ax.legend()
+    if fileName is None:
+        plt.show()
+    else:
+        fig.savefig(fileName)
+    return fig